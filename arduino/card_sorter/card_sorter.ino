@@ -368,17 +368,38 @@ class TrayDriver {
 public:
   enum State { PAUSED, SENDING, STOPPING, EMPTY };
 
-  void SendLeft() {
+  // If report_done is false, the tray doesn't send "done" when it finishes.
+  // That's for compound commands, which send a single reply at the very end.
+  void SendLeft(bool report_done = true) {
     state_ = SENDING;
+    report_done_ = report_done;
     StartMotor(device.tray, Forward, device.tray.speed);
   }
 
-  void SendRight() {
+  void SendRight(bool report_done = true) {
     state_ = SENDING;
+    report_done_ = report_done;
     StartMotor(device.tray, Backward, device.tray.speed);
   }
 
-  bool IsPaused() { return state_ == PAUSED; }
+  // Sends the card into an output tray. The tray tips one way or the other,
+  // so there are two output trays: 0 is left and 1 is right. Machines with
+  // more output trays drive the extra ones from here. Returns false if there's
+  // no such tray.
+  bool Send(long tray, bool report_done = true) {
+    switch (tray) {
+    case 0:
+      SendLeft(report_done);
+      return true;
+    case 1:
+      SendRight(report_done);
+      return true;
+    default:
+      return false;
+    }
+  }
+
+  bool IsPaused() const { return state_ == PAUSED; }
 
   void ProcessStep() {
     switch (state_) {
@@ -398,7 +419,9 @@ public:
       } else if (IsTrayMotorReturned()) {
         StopMotor(device.tray);
         state_ = PAUSED;
-        Serial.println("done");
+        if (report_done_) {
+          Serial.println("done");
+        }
       }
       break;
 
@@ -409,6 +432,7 @@ public:
 
 private:
   State state_ = PAUSED;
+  bool report_done_ = true;
 };
 
 // You can't really tell if the feed system is fully empty of cards while
@@ -447,6 +471,72 @@ private:
   State state_ = IDLE;
 };
 
+// Feeds the next card once the tray and the hopper are at rest, unless the
+// hopper is empty. It's the equivalent of "is_hopper_empty" followed by
+// "next_card", but in a single exchange with the controller, which saves a
+// serial round trip for every card.
+//
+// The only reply is either "empty", or the secondary hopper's "done" when the
+// card arrives in the tray.
+class NextCardSequence {
+public:
+  enum State {
+    IDLE,
+    WAITING,
+  };
+
+  NextCardSequence(SecondaryHopperDriver *hopper, const TrayDriver *tray)
+      : hopper_(hopper), tray_(tray) {}
+
+  void Start() { state_ = WAITING; }
+
+  void ProcessStep() {
+    switch (state_) {
+    case IDLE:
+      // Do nothing.
+      break;
+
+    case WAITING:
+      if (tray_->IsPaused() && !hopper_->IsRunning()) {
+        state_ = IDLE;
+        if (hopper_->IsEmpty()) {
+          Serial.println("empty");
+        } else {
+          hopper_->Start();
+        }
+      }
+      break;
+    }
+  }
+
+private:
+  SecondaryHopperDriver *hopper_;
+  const TrayDriver *tray_;
+  State state_ = IDLE;
+};
+
+// Handles "send <tray>" and "send_then_next <tray>", the generalizations of
+// the left and right commands to any number of output trays. If the tray
+// doesn't exist, the card stays where it is and the reply is an "error:" line
+// instead of "done", so the host can't mistake it for a card being moved.
+void SendToTray(TrayDriver &tray, NextCardSequence &next_card,
+                const String &argument, bool then_next) {
+  bool is_number = argument.length() > 0;
+  for (unsigned int i = 0; i < argument.length(); i++) {
+    if (!isDigit(argument[i])) {
+      is_number = false;
+    }
+  }
+  if (!is_number || !tray.Send(argument.toInt(), !then_next)) {
+    Serial.print(F("error: no such tray: "));
+    Serial.println(argument);
+    return;
+  }
+  if (then_next) {
+    next_card.Start();
+  }
+}
+
 void Initialize() {
   // Read the json config that follows the initialize command and put everything
   // in the right place.
@@ -515,12 +605,14 @@ void loop() {
   static SecondaryHopperDriver secondary_hopper(&primary_hopper);
   static TrayDriver tray;
   static HopperQuery query(&secondary_hopper, &tray);
+  static NextCardSequence next_card(&secondary_hopper, &tray);
 
   if (started) {
     primary_hopper.ProcessStep();
     secondary_hopper.ProcessStep();
     tray.ProcessStep();
     query.ProcessStep();
+    next_card.ProcessStep();
   }
 
   if (Serial.available()) {
@@ -531,6 +623,18 @@ void loop() {
       tray.SendLeft();
     } else if (result == "next_card") {
       secondary_hopper.Start();
+    } else if (result == "next_if_not_empty") {
+      next_card.Start();
+    } else if (result == "send_right_then_next") {
+      tray.SendRight(false);
+      next_card.Start();
+    } else if (result == "send_left_then_next") {
+      tray.SendLeft(false);
+      next_card.Start();
+    } else if (result.startsWith("send ")) {
+      SendToTray(tray, next_card, result.substring(5), false);
+    } else if (result.startsWith("send_then_next ")) {
+      SendToTray(tray, next_card, result.substring(15), true);
     } else if (result == "is_hopper_empty") {
       query.Query();
     } else if (result == "reset_hopper") {
@@ -14,110 +14,85 @@
 # You should have received a copy of the GNU General Public License along with
 # OpenSorts. If not, see <https://www.gnu.org/licenses/>.
 
-import platform
-import sys
-import time
+import asyncio
 
-import tensorflow as tf
-import tensorflow_addons as tfa
-import cv2
-
-import card_recognizer
-import transform
-import prof_timer
-import common
-import thumbnailer
+import async_device
 
 
 class Sorter:
-    """Provides an interface to the Arduino and camera hardware."""
+    """
+    Provides a synchronous interface to the Arduino and camera hardware. It's a
+    thin wrapper that runs each call of an async_device.AsyncSorter to
+    completion.
+    """
 
     def __init__(self, config, catalog, card_lookup):
-        config = config
-        self.thumbnailer = thumbnailer.Thumbnailer()
-        self.card_lookup = card_lookup
-        print('Initializing recognizer.')
-        self.recognizer = card_recognizer.Recognizer(catalog)
-
-        print('Creating camera.')
-        if platform.system() == 'Windows':
-            # On Windows, the DirectShow interface seems to be faster and
-            # more reliable
-            print('Using DirectShow')
-            self.vc = cv2.VideoCapture(config.camera_id, cv2.CAP_DSHOW)
-        else:
-            self.vc = cv2.VideoCapture(config.camera_id)
-        self.vc.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-        self.vc.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-        self.vc.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-
-        print('Opening camera.')
-        if not self.vc.isOpened():
-            print('Failed to open camera.')
-            sys.exit()
-
-        self.serial_port = common.open_device(config)
-        common.send_command(self.serial_port, 'start')
+        self.loop = asyncio.new_event_loop()
+        self.device = async_device.AsyncSorter(config, catalog, card_lookup)
+        self.recognizer = self.device.recognizer
 
     def __del__(self):
-        self.vc.release()
-        self.serial_port.close()
-
-    def get_camera_image(self):
-        # For reasons I haven't diagnosed, the camera seems to lag very far
-        # behind reality. Through experimentation I've found that I have to
-        # wait for the 5th frame for things to have settled down.
-        for i in range(5):
-            rval, frame = self.vc.read()
-            if not rval:
-                print('Error code on frame capture.')
-                sys.exit()
-
-        # The image comes from the camera in BGR byte order and we need it
-        # in RGB.
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        image, _ = self.thumbnailer.thumbnail(frame)
-        # I'm not sure if brightness and contrast adjustment is needed.
-        # Further experiments are needed to determine if this helps recognition
-        # accuracy.
-        image, _, _ = transform.automatic_brightness_and_contrast(
-            tf.image.convert_image_dtype(image, tf.uint8).numpy())
-        image = tf.image.convert_image_dtype(image, tf.float32)
-        # The camera is mounted so the images come in sideways. Rotate them 90
-        # degrees.
-        image = tf.image.rot90(image, k=1)
-        return (image, frame)
-
-    def identify_next(self):
-        common.send_command(self.serial_port, 'next_card')
-        # The Arduino sends its "done" reply when the tray sensors have been
-        # triggered, but the card will still be in motion for a little while.
-        time.sleep(.3)
-        image, frame = self.get_camera_image()
-        with prof_timer.PerfTimer('recognize'):
-            card_id, distance = self.recognizer.recognize(image)
-        return card_id, tf.image.convert_image_dtype(
-            image, tf.uint8), tf.image.convert_image_dtype(frame, tf.uint8)
+        self.device.close()
+        self.loop.close()
+
+    def run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def feed_next(self):
+        """
+        Feeds the next card into the tray. Returns False if the hopper is
+        empty.
+        """
+        return self.run(self.device.feed_next())
+
+    def send_and_feed_next(self, tray):
+        """
+        Sends the card into an output tray, numbered from 0, or 'left' or
+        'right', then feeds the next card. Returns False if the hopper is
+        empty.
+        """
+        return self.run(self.device.send_and_feed_next(tray))
+
+    def identify(self, expected_card_id=None):
+        """Recognizes the card that was just fed into the tray."""
+        return self.run(self.device.identify(expected_card_id))
+
+    def last_images(self):
+        """
+        Returns copies of (card image, full RGB camera frame) for the last
+        card identified.
+        """
+        return self.device.last_images()
+
+    def restrict_candidates(self, card_ids):
+        """Tells the recognizer to look at these cards before any others."""
+        self.device.restrict_candidates(card_ids)
+
+    def send(self, tray):
+        """
+        Sends the card into an output tray, numbered from 0, or 'left' or
+        'right'.
+        """
+        self.run(self.device.send(tray))
 
     def send_left(self):
-        common.send_command(self.serial_port, 'send_left')
+        self.run(self.device.send_left())
 
     def send_right(self):
-        common.send_command(self.serial_port, 'send_right')
+        self.run(self.device.send_right())
 
     def reload(self):
-        while not self.is_hopper_reloaded():
-            input('Reload the hopper and press Enter...')
-        common.send_command(self.serial_port, 'reset_hopper')
+        self.run(self.device.reload())
 
     def is_hopper_empty(self):
-        result, _ = common.send_command(self.serial_port, 'is_hopper_empty')
-        return result == 'empty'
+        return self.run(self.device.is_hopper_empty())
 
     def is_hopper_reloaded(self):
-        result, _ = common.send_command(self.serial_port, 'is_hopper_reloaded')
-        print(f'Reload result: {result}')
-        return result == 'not_empty'
+        return self.run(self.device.is_hopper_reloaded())
+
+    def save_state(self):
+        """Saves anything that should persist across sorting sessions."""
+        self.run(self.device.save_state())
 
     def print(self):
-        pass
+        self.device.print()
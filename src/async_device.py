@@ -0,0 +1,239 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import concurrent.futures
+import sys
+import time
+
+import camera_capture
+import card_recognizer
+import common
+import preprocessing
+import prof_timer
+import settle_detector
+import sort_cards
+import thumbnailer
+
+
+class AsyncSorter:
+    """
+    Provides an asyncio interface to the Arduino and camera hardware.
+
+    Nothing here blocks the event loop. Serial I/O runs on a dedicated device
+    thread, so commands reach the Arduino one at a time and in order, exactly
+    as the firmware expects. Settle detection, preprocessing and inference run
+    on a separate inference thread. The camera already has its own capture
+    thread. While one of them is busy, the event loop is free to log, archive
+    images, or wait on the other.
+
+    We don't use a natively asynchronous serial transport because the
+    available ones don't support Windows, which is what most of these
+    machines run on.
+    """
+    def __init__(self, config, catalog, card_lookup, metrics=None):
+        self.metrics = metrics
+        self.thumbnailer = thumbnailer.Thumbnailer(config)
+        self.preprocessor = preprocessing.FramePreprocessor(self.thumbnailer)
+        self.card_lookup = card_lookup
+        print('Initializing recognizer.')
+        self.recognizer = card_recognizer.Recognizer(catalog, config)
+        # Crop cards straight to the model's input size if the thumbnailer
+        # can.
+        height, width = self.recognizer.image_dimensions
+        self.thumbnailer.set_card_size(width, height)
+
+        print('Creating camera.')
+        self.camera = camera_capture.CameraCapture(config)
+        self.settle_detector = settle_detector.SettleDetector(
+            self.camera, config)
+
+        # Compound commands combine routing the card in the tray, checking
+        # whether the hopper is empty, and feeding the next card into a single
+        # exchange with the Arduino. They need up-to-date firmware.
+        self.compound_commands = common.get_setting(config,
+                                                    'compound_commands', False)
+        # The number of output trays. The standard machine has two, left and
+        # right, which are tray 0 and tray 1.
+        self.tray_count = common.get_setting(config, 'tray_count', 2)
+        # When the last card arrived in the tray, from time.monotonic().
+        self.arrival_time = None
+        # The recognition distance of the last card identified.
+        self.last_distance = None
+
+        self.device_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='device')
+        self.inference_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='inference')
+
+        self.serial_port = common.open_device(config)
+        common.send_command(self.serial_port, 'start')
+
+    def close(self):
+        self.device_executor.shutdown()
+        self.inference_executor.shutdown()
+        self.camera.release()
+        self.serial_port.close()
+
+    async def send_command(self, command):
+        """Sends a command to the Arduino and returns (result, log)."""
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        response = await loop.run_in_executor(
+            self.device_executor,
+            prof_timer.run_in_context(common.send_command, self.serial_port,
+                                      command))
+        if self.metrics is not None:
+            self.metrics.record_command(command, time.monotonic() - start)
+        return response
+
+    async def feed_next(self):
+        """
+        Feeds the next card into the tray. Returns False if the hopper is
+        empty.
+        """
+        if self.compound_commands:
+            return await self.await_card('next_if_not_empty')
+        if await self.is_hopper_empty():
+            return False
+        return await self.await_card('next_card')
+
+    def tray_index(self, tray):
+        """Accepts a tray number, or 'left' or 'right' for trays 0 and 1."""
+        if tray in sort_cards.TRAY_NAMES:
+            return sort_cards.TRAY_NAMES.index(tray)
+        if not 0 <= tray < self.tray_count:
+            raise ValueError(f'There is no tray {tray}.')
+        return tray
+
+    async def send_and_feed_next(self, tray):
+        """
+        Sends the card into the given output tray (see `send`), then feeds the
+        next card. Returns False if the hopper is empty.
+        """
+        tray = self.tray_index(tray)
+        if self.compound_commands:
+            # The two-tray commands still work with older firmware.
+            if self.tray_count == 2:
+                command = f'send_{sort_cards.TRAY_NAMES[tray]}_then_next'
+            else:
+                command = f'send_then_next {tray}'
+            return await self.await_card(command)
+        await self.send(tray)
+        return await self.feed_next()
+
+    async def await_card(self, command):
+        with prof_timer.PerfTimer(command):
+            result, _ = await self.send_command(command)
+        # The Arduino sends its "done" reply when the tray sensors have been
+        # triggered, but the card will still be in motion for a little while.
+        # That's handled when the image is captured.
+        self.arrival_time = time.monotonic()
+        return result == 'done'
+
+    def get_camera_image(self, moment):
+        """
+        Returns the upright card image from the first frame after `moment` (a
+        time.monotonic() timestamp) in which the card has settled. The image is
+        only valid until the next capture.
+        """
+        with prof_timer.PerfTimer('settle'):
+            captured = self.settle_detector.wait_for_settled_frame(moment)
+        if captured is None:
+            print('Error code on frame capture.')
+            sys.exit()
+        _, frame = captured
+        image, _ = self.preprocessor.process(frame)
+        return image
+
+    def recognize_card(self, moment, expected_card_id):
+        image = self.get_camera_image(moment)
+        with prof_timer.PerfTimer('recognize'):
+            card_id, distance = self.recognizer.recognize(
+                image, expected_card_id)
+        self.last_distance = distance
+        return card_id
+
+    async def identify(self, expected_card_id=None):
+        """Recognizes the card that was just fed into the tray."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.inference_executor,
+            prof_timer.run_in_context(self.recognize_card, self.arrival_time,
+                                      expected_card_id))
+
+    def last_images(self):
+        """
+        Returns copies of (card image, full RGB camera frame) for the last
+        card identified. Only call this if you need them, e.g. for archiving,
+        since copying the full frame isn't free. Don't call it while `identify`
+        is running.
+        """
+        return (self.preprocessor.card_image.copy(),
+                self.preprocessor.rgb_frame.copy())
+
+    def restrict_candidates(self, card_ids):
+        """Tells the recognizer to look at these cards before any others."""
+        self.recognizer.set_candidates(card_ids)
+
+    async def send(self, tray):
+        """
+        Sends the card into an output tray, numbered from 0, or 'left' or
+        'right'.
+        """
+        tray = self.tray_index(tray)
+        # The two-tray commands still work with older firmware.
+        if self.tray_count == 2:
+            await self.send_command(f'send_{sort_cards.TRAY_NAMES[tray]}')
+        else:
+            await self.send_command(f'send {tray}')
+
+    async def send_left(self):
+        await self.send(0)
+
+    async def send_right(self):
+        await self.send(1)
+
+    async def reload(self):
+        loop = asyncio.get_running_loop()
+        while not await self.is_hopper_reloaded():
+            await loop.run_in_executor(None, input,
+                                       'Reload the hopper and press Enter...')
+        await self.send_command('reset_hopper')
+
+    async def is_hopper_empty(self):
+        result, _ = await self.send_command('is_hopper_empty')
+        return result == 'empty'
+
+    async def is_hopper_reloaded(self):
+        result, _ = await self.send_command('is_hopper_reloaded')
+        print(f'Reload result: {result}')
+        return result == 'not_empty'
+
+    async def save_state(self):
+        """Saves anything that should persist across sorting sessions."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self.inference_executor,
+            prof_timer.run_in_context(self.recognizer.save_cache))
+
+    def print(self):
+        self.camera.print()
+        self.settle_detector.print()
+        cache = self.recognizer.cache
+        if cache is not None:
+            print(f'Recognition cache: {cache.hits} hits, ' +
+                  f'{cache.misses} misses ({cache.hit_rate():.0%} hit rate)')
@@ -0,0 +1,84 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+# Builds the IVF embedding index from the embedding store (or
+# embedding_dictionary.pickle, if it hasn't been converted yet), saves it, and
+# prints a recall/latency report comparing it with the brute-force search.
+
+import time
+
+import numpy as np
+
+import common
+import embedding_index
+import embedding_store
+
+# The report uses catalog embeddings with a little noise added as stand-ins for
+# embeddings of real photographs.
+NUM_QUERIES = 1000
+QUERY_NOISE = 0.03
+# The different numbers of probed lists to report on.
+PROBE_COUNTS = [1, 2, 4, 8, 16, 32]
+
+
+def time_search(index, queries):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        nearest, _ = index.search(np.expand_dims(query, axis=0))
+        latencies.append(time.perf_counter() - start)
+        results.append(nearest[0])
+    return np.array(results), np.array(latencies) * 1000
+
+
+config = common.load_config()
+path = common.get_setting(config, 'recognizer.index.path',
+                          'embedding_index.npz')
+num_lists = common.get_setting(config, 'recognizer.index.num_lists', 256)
+num_probes = common.get_setting(config, 'recognizer.index.num_probes', 8)
+
+print('Loading embeddings.')
+card_ids, embedding_matrix = embedding_store.load_embeddings(
+    embedding_store.MODEL_PATH)
+print(f'{len(card_ids)} embeddings of size {embedding_matrix.shape[1]}')
+
+print(f'Building IVF index with {num_lists} lists.')
+start = time.perf_counter()
+ivf = embedding_index.IvfIndex.build(embedding_matrix, num_lists, num_probes)
+print(f'Built in {time.perf_counter() - start:.1f}s')
+ivf.save(path, card_ids)
+print(f'Saved to {path}')
+
+rng = np.random.default_rng(0)
+queries = embedding_matrix[rng.choice(len(embedding_matrix),
+                                      NUM_QUERIES,
+                                      replace=False)].astype(np.single)
+queries += rng.normal(scale=QUERY_NOISE, size=queries.shape)
+queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+brute_force = embedding_index.BruteForceIndex(embedding_matrix)
+expected, latencies = time_search(brute_force, queries)
+print()
+print(f'{"index":>16} {"recall@1":>9} {"mean ms":>8} {"p95 ms":>8}')
+print(f'{"brute force":>16} {1.0:>9.4f} {np.mean(latencies):>8.3f} ' +
+      f'{np.percentile(latencies, 95):>8.3f}')
+for probes in PROBE_COUNTS:
+    ivf.num_probes = min(probes, len(ivf.centroids))
+    results, latencies = time_search(ivf, queries)
+    recall = np.mean(results == expected)
+    print(f'{f"ivf probes={probes}":>16} {recall:>9.4f} ' +
+          f'{np.mean(latencies):>8.3f} {np.percentile(latencies, 95):>8.3f}')
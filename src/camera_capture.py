@@ -0,0 +1,188 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+import platform
+import sys
+import threading
+import time
+
+import cv2
+
+import common
+
+FRAME_WIDTH = 1280
+FRAME_HEIGHT = 720
+
+
+def open_video_capture(config):
+    """Opens the camera with the settings that work best for us."""
+    camera_id = config.camera_id
+    if camera_id == 'emulator':
+        import device_emulator
+        print('Using the emulated camera.')
+        return device_emulator.VirtualCamera(
+            device_emulator.get_emulator(config))
+    if platform.system() == 'Windows':
+        # On Windows, the DirectShow interface seems to be faster and
+        # more reliable
+        print('Using DirectShow')
+        vc = cv2.VideoCapture(camera_id, cv2.CAP_DSHOW)
+    else:
+        vc = cv2.VideoCapture(camera_id)
+    vc.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    vc.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
+    vc.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
+    return vc
+
+
+class CameraCapture:
+    """
+    Reads frames from the camera continuously on a background thread, and
+    keeps the most recent ones in a ring buffer along with the time they were
+    captured.
+
+    Reading from the camera only when we want a picture means getting whatever
+    stale frames the driver has buffered, which is why we used to read and throw
+    away five frames per card. With a thread draining the camera all the time,
+    a fresh frame is always waiting, and `frame_after` can hand out the first
+    frame captured after a particular moment, e.g. when the card came to rest.
+
+    Timestamps come from time.monotonic(), taken when each frame arrives.
+
+    The settings come from `camera` in the config:
+
+    ring_size: How many recent frames to keep. Defaults to 8.
+    """
+    def __init__(self, config):
+        self.ring_size = common.get_setting(config, 'camera.ring_size', 8)
+        self.vc = open_video_capture(config)
+        print('Opening camera.')
+        if not self.vc.isOpened():
+            print('Failed to open camera.')
+            sys.exit()
+        fps = self.vc.get(cv2.CAP_PROP_FPS)
+        self.frame_period = 1 / fps if fps > 0 else 1 / 30
+
+        # The ring buffer of (timestamp, frame), and the total number of frames
+        # that have been written to it.
+        self.frames = [None] * self.ring_size
+        self.frame_count = 0
+        self.condition = threading.Condition()
+        self.running = True
+        self.failed = False
+
+        # Frames the camera should have delivered, judging by the gaps between
+        # the frames it did deliver.
+        self.dropped_frames = 0
+        # How old frames were when they were handed out, in seconds.
+        self.frames_used = 0
+        self.total_frame_age = 0
+        self.max_frame_age = 0
+
+        self.thread = threading.Thread(target=self.capture_loop,
+                                       name='camera capture',
+                                       daemon=True)
+        self.thread.start()
+
+    def capture_loop(self):
+        previous_timestamp = None
+        while self.running:
+            rval, frame = self.vc.read()
+            timestamp = time.monotonic()
+            if not rval:
+                print('Error code on frame capture.')
+                with self.condition:
+                    self.failed = True
+                    self.condition.notify_all()
+                return
+            if previous_timestamp is not None:
+                missed = round((timestamp - previous_timestamp) /
+                               self.frame_period) - 1
+                if missed > 0:
+                    self.dropped_frames += missed
+            previous_timestamp = timestamp
+            with self.condition:
+                self.frames[self.frame_count % self.ring_size] = (timestamp,
+                                                                  frame)
+                self.frame_count += 1
+                self.condition.notify_all()
+
+    def buffered_frames(self):
+        """The frames in the ring buffer, oldest first."""
+        first = max(0, self.frame_count - self.ring_size)
+        return [
+            self.frames[i % self.ring_size]
+            for i in range(first, self.frame_count)
+        ]
+
+    def wait_for(self, find_frame, timeout):
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                found = find_frame()
+                if found is not None:
+                    age = time.monotonic() - found[0]
+                    self.frames_used += 1
+                    self.total_frame_age += age
+                    self.max_frame_age = max(self.max_frame_age, age)
+                    return found
+                remaining = deadline - time.monotonic()
+                if self.failed or remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def frame_after(self, moment, timeout=2):
+        """
+        Returns (timestamp, frame) for the first frame captured after `moment`,
+        waiting for it if necessary. Returns None if the camera fails, or no
+        frame arrives within `timeout` seconds.
+        """
+        def find_frame():
+            for timestamp, frame in self.buffered_frames():
+                if timestamp > moment:
+                    return timestamp, frame
+            return None
+
+        return self.wait_for(find_frame, timeout)
+
+    def latest(self, newer_than=None, timeout=2):
+        """
+        Returns (timestamp, frame) for the most recent frame. If `newer_than` is
+        given, waits until there's a frame captured after it. Returns None if
+        the camera fails, or no frame arrives within `timeout` seconds.
+        """
+        def find_frame():
+            if self.frame_count == 0:
+                return None
+            newest = self.frames[(self.frame_count - 1) % self.ring_size]
+            if newer_than is not None and newest[0] <= newer_than:
+                return None
+            return newest
+
+        return self.wait_for(find_frame, timeout)
+
+    def release(self):
+        self.running = False
+        self.thread.join()
+        self.vc.release()
+
+    def print(self):
+        mean_age = (self.total_frame_age / self.frames_used
+                    if self.frames_used > 0 else 0)
+        print(f'Camera: {self.frame_count} frames captured, ' +
+              f'{self.dropped_frames} dropped, frame age when used: ' +
+              f'{mean_age * 1000:.0f} ms mean, ' +
+              f'{self.max_frame_age * 1000:.0f} ms max')
@@ -17,98 +17,196 @@
 import cv2
 import pygame
 import numpy as np
-import sys
-import platform
+import queue
+import threading
+import time
 import uuid
 
-import tensorflow as tf
-import tensorflow_addons as tfa
 import transform
 
 from pygame import display
+import camera_capture
 import card_recognizer
 import common
+import frame_gate
+import prof_timer
 import thumbnailer
 
+# The stage latencies are smoothed over roughly this many frames.
+SMOOTHING = 10
+
 
 def cvimage_to_pygame(image):
-    """Convert cvimage into a pygame image"""
-    return pygame.image.frombuffer(image.tobytes(), image.shape[1::-1], "RGB")
+    """
+    Wraps an RGB image in a pygame surface without copying it. The surface
+    refers to the image's memory, so the image has to stay alive and unchanged
+    for as long as the surface is in use.
+    """
+    return pygame.image.frombuffer(image, image.shape[1::-1], 'RGB')
+
+
+def put_latest(stage_queue, item):
+    """
+    Puts the item on a bounded queue, throwing away the oldest item if it's
+    full. The later stages only care about the newest frame or result, so a
+    slow stage never holds up the ones before it.
+    """
+    while True:
+        try:
+            stage_queue.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                stage_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+
+class StageTimes:
+    """Smoothed latencies of the pipeline stages, from any thread."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.milliseconds = {}
+
+    def record(self, stage, seconds):
+        with self.lock:
+            previous = self.milliseconds.get(stage, seconds * 1000)
+            self.milliseconds[stage] = previous + (seconds * 1000 -
+                                                   previous) / SMOOTHING
+
+    def lines(self):
+        with self.lock:
+            return [
+                f'{stage}: {milliseconds:.1f} ms'
+                for stage, milliseconds in self.milliseconds.items()
+            ]
 
 
 print('Loading config')
 config = common.load_config()
+prof_timer.configure(config)
 print('Loading catalog')
 catalog, cards_by_id = common.load_catalog()
 print('Initializing recognizer.')
-recognizer = card_recognizer.Recognizer(catalog)
+recognizer = card_recognizer.Recognizer(catalog, config)
 
 print('Initializing Corner Detector.')
-corner_detector = thumbnailer.Thumbnailer()
+corner_detector = thumbnailer.Thumbnailer(config)
+height, width = recognizer.image_dimensions
+corner_detector.set_card_size(width, height)
+gate = frame_gate.FrameGate(corner_detector, config)
 
 pygame.init()
 
 surface = display.set_mode(size=(1280, 720))
 
 print('Creating camera.')
-if platform.system() == 'Windows':
-    # On Windows, the DirectShow interface seems to be faster and
-    # more reliable
-    print('Using DirectShow')
-    vc = cv2.VideoCapture(config.camera_id, cv2.CAP_DSHOW)
-else:
-    vc = cv2.VideoCapture(config.camera_id)
-vc.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-vc.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-vc.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-print('Opening camera.')
-if not vc.isOpened():
-    print('Failed to open camera.')
-    sys.exit()
+camera = camera_capture.CameraCapture(config)
 
 font = pygame.font.Font(pygame.font.get_default_font(), 32)
+small_font = pygame.font.Font(pygame.font.get_default_font(), 16)
+
+# The camera captures frames on its own thread. The newest frame is passed to
+# the inference thread, and its newest result is passed back to be rendered,
+# each through a queue that only holds one item. So the display keeps up with
+# the camera no matter how long recognition takes.
+frames = queue.Queue(maxsize=1)
+results = queue.Queue(maxsize=1)
+stage_times = StageTimes()
+
+
+def inference_loop():
+    while True:
+        captured = frames.get()
+        if captured is None:
+            return
+        timestamp, frame = captured
+        start = time.perf_counter()
+        # Model processing. It's only done when something in view has
+        # changed; otherwise the last result keeps being displayed.
+        recognize = gate.should_recognize(frame)
+        gated = time.perf_counter()
+        stage_times.record('gate', gated - start)
+        if not recognize:
+            continue
+        corners = gate.find_corners(frame)
+        found_corners = time.perf_counter()
+        cropped, corners = corner_detector.upright_card(frame, corners)
+        cropped_card = time.perf_counter()
+        card_id, distance = recognizer.recognize(cropped)
+        recognized = time.perf_counter()
+        stage_times.record('corners', found_corners - gated)
+        stage_times.record('crop', cropped_card - found_corners)
+        stage_times.record('recognize', recognized - cropped_card)
+        stage_times.record('result age', time.monotonic() - timestamp)
+
+        card_text = (
+            f'{cards_by_id[card_id]["name"]}[{cards_by_id[card_id]["set"]}]' +
+            f' : {distance:.2f}')
+        print(card_text)
+        put_latest(results, (card_text, corners))
+
+
+inference_thread = threading.Thread(target=inference_loop,
+                                    name='inference',
+                                    daemon=True)
+inference_thread.start()
 
 running = True
+timestamp = None
+card_text = None
+corners = None
 while running:
-    # Grab the next frame.
-    rval, frame = vc.read()
-    if not rval:
+    # Grab the newest frame we haven't displayed yet.
+    captured = camera.latest(newer_than=timestamp)
+    if captured is None:
         print('Error code on frame capture.')
         running = False
         continue
-    # Convert the frame to the RGB color space.
+    timestamp, frame = captured
+    start = time.perf_counter()
+    # Convert the frame to the RGB color space. The converted frame is never
+    # modified afterwards, so the inference thread and the display can share
+    # it.
     frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-    # Model processing
-    cropped, corners = corner_detector.thumbnail(frame)
-
-    cropped = tf.image.rot90(cropped, k=1)
-    cropped = tf.image.convert_image_dtype(cropped, tf.float32)
-    card_id, distance = recognizer.recognize(cropped)
-    card_text = (
-        f'{cards_by_id[card_id]["name"]}[{cards_by_id[card_id]["set"]}]' +
-        f' : {distance:.2f}')
-    print(card_text)
-
-    # Render the bounding quad and recognition info.
-    text_surface = font.render(card_text, True, (255, 255, 255))
-    text_rect = text_surface.get_rect()
-    text_rect.center = (
-        (corners[0][0] + corners[1][0] + corners[2][0] + corners[3][0]) / 4,
-        (corners[0][1] + corners[1][1] + corners[2][1] + corners[3][1]) / 4)
+    converted = time.perf_counter()
+    put_latest(frames, (timestamp, frame))
+    try:
+        card_text, corners = results.get_nowait()
+    except queue.Empty:
+        pass
 
     surface.blit(cvimage_to_pygame(frame), (0, 0))
-    surface.blit(text_surface, text_rect)
-    pygame.draw.line(surface, (0, 255, 0), (corners[0][0], corners[0][1]),
-                     (corners[1][0], corners[1][1]), 3)
-    pygame.draw.line(surface, (0, 255, 0), (corners[1][0], corners[1][1]),
-                     (corners[2][0], corners[2][1]), 3)
-    pygame.draw.line(surface, (0, 255, 0), (corners[2][0], corners[2][1]),
-                     (corners[3][0], corners[3][1]), 3)
-    pygame.draw.line(surface, (0, 255, 0), (corners[3][0], corners[3][1]),
-                     (corners[0][0], corners[0][1]), 3)
+
+    # Render the bounding quad and recognition info, once there is some.
+    if card_text is not None:
+        text_surface = font.render(card_text, True, (255, 255, 255))
+        text_rect = text_surface.get_rect()
+        text_rect.center = (
+            (corners[0][0] + corners[1][0] + corners[2][0] + corners[3][0]) /
+            4,
+            (corners[0][1] + corners[1][1] + corners[2][1] + corners[3][1]) /
+            4)
+
+        surface.blit(text_surface, text_rect)
+        pygame.draw.line(surface, (0, 255, 0), (corners[0][0], corners[0][1]),
+                         (corners[1][0], corners[1][1]), 3)
+        pygame.draw.line(surface, (0, 255, 0), (corners[1][0], corners[1][1]),
+                         (corners[2][0], corners[2][1]), 3)
+        pygame.draw.line(surface, (0, 255, 0), (corners[2][0], corners[2][1]),
+                         (corners[3][0], corners[3][1]), 3)
+        pygame.draw.line(surface, (0, 255, 0), (corners[3][0], corners[3][1]),
+                         (corners[0][0], corners[0][1]), 3)
+
+    # Render the stage latencies in the top left corner.
+    for row, line in enumerate(stage_times.lines()):
+        surface.blit(small_font.render(line, True, (255, 255, 0)),
+                     (10, 10 + row * 20))
 
     display.update()
+    stage_times.record('convert', converted - start)
+    stage_times.record('render', time.perf_counter() - converted)
+    stage_times.record('frame age', time.monotonic() - timestamp)
 
     # If the space bar was hit, then save the frame to the "scans"
     # directory for later tagging.
@@ -117,7 +215,11 @@ while running:
             running = False
         elif event.type == pygame.KEYUP:
             if event.key == pygame.K_SPACE:
-                tf.io.write_file(f'scans/{uuid.uuid1()}_full.jpg',
-                                 tf.io.encode_jpeg(frame))
-
-vc.release()
+                cv2.imwrite(f'scans/{uuid.uuid1()}_full.jpg',
+                            cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+
+put_latest(frames, None)
+inference_thread.join()
+gate.print()
+camera.print()
+camera.release()
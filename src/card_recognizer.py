@@ -14,12 +14,15 @@
 # You should have received a copy of the GNU General Public License along with
 # OpenSorts. If not, see <https://www.gnu.org/licenses/>.
 
-import pickle
+import cv2
 import numpy as np
-import tensorflow as tf
-import tensorflow.keras.applications as applications
 import random
 
+import common
+import embedding_index
+import embedding_store
+import interpreters
+import recognition_cache
 import prof_timer
 
 from collections import namedtuple
@@ -32,14 +35,41 @@ CardIdentifier = namedtuple('CardIdentifier',
                             ' '.join(['name', 'set_code', 'face_index']))
 
 
+def filter_catalog(catalog, sets=None, released_after=None):
+    """
+    Returns the ids of the cards in the catalog that are in one of `sets` and
+    were released on or after `released_after` (an ISO format date string).
+    Either filter can be None.
+    """
+    card_ids = []
+    for card in catalog:
+        if sets is not None and card['set'] not in sets:
+            continue
+        released_at = card.get('released_at') or ''
+        if released_after is not None and released_at < released_after:
+            continue
+        card_ids.append(f'{card["id"]}_{card["face_index"]}')
+    return card_ids
+
+
 class Recognizer:
-    def __init__(self, catalog):
+    def __init__(self, catalog, config=None):
         self.catalog = catalog
         print('Loading card recognizer.')
+        # If the upright orientation is at least this close to a card, don't
+        # bother checking the inverted orientation. When unset, both
+        # orientations are always checked.
+        self.early_exit_distance = common.get_setting(
+            config, 'recognizer.early_exit_distance')
         # The embedding model turns an image of a card into an embedding vector.
-        self.embedding_interpreter = tf.lite.Interpreter(
-            model_path='embedding_model.tflite')
-        self.embedding_interpreter.allocate_tensors()
+        # Without early exit, both orientations are always needed, so embed
+        # them together in a single batched invoke.
+        self.batch_size = 1 if self.early_exit_distance is not None else 2
+        self.embedding_interpreter = interpreters.make_interpreter(
+            config,
+            'embedding',
+            embedding_store.MODEL_PATH,
+            batch_size=self.batch_size)
         self.embedding_input_details = self.embedding_interpreter.get_input_details(
         )[0]
         self.embedding_output_details = self.embedding_interpreter.get_output_details(
@@ -47,51 +77,205 @@ class Recognizer:
         self.image_dimensions = (self.embedding_input_details['shape'][1],
                                  self.embedding_input_details['shape'][2])
         print(f'Model image dimensions: {self.image_dimensions}')
+        # Holds the upright and inverted model inputs, reused for every card.
+        input_shape = self.embedding_input_details['shape'][1:]
+        self.model_input = np.empty((2, *input_shape), dtype=np.single)
 
-        # The embedding dictionary maps embedding vectors to card ids.
-        with open('embedding_dictionary.pickle', 'rb') as handle:
-            embedding_dictionary = pickle.load(handle)
-        # Turn the embedding dictionary into a numpy matrix for efficiency.
-        self.card_ids = []
-        embedding_list = []
-        for card_id, embedding in embedding_dictionary.items():
-            self.card_ids.append(card_id)
-            embedding_list.append(embedding)
-        self.embedding_matrix = np.array(embedding_list)
-
-    def recognize_by_embedding(self, image):
-        # Scale the image values to what the network expects.
-        with prof_timer.PerfTimer('preprocess'):
-            image = applications.mobilenet_v2.preprocess_input(image * 255.0)
+        # The embedding store maps card ids to embedding vectors. The matrix is
+        # memory-mapped, so it's shared between processes and paged in lazily.
+        embedding_size = self.embedding_output_details['shape'][-1]
+        self.card_ids, self.embedding_matrix = embedding_store.load_embeddings(
+            embedding_store.MODEL_PATH, embedding_size)
+        self.index = embedding_index.load_index(config, self.embedding_matrix,
+                                                self.card_ids)
+        print(f'Using {type(self.index).__name__} for nearest neighbour search.')
+        self.rows_by_id = {
+            card_id: row
+            for row, card_id in enumerate(self.card_ids)
+        }
 
-        # Generate the embedding from the image.
+        # The candidate index is a small index of just the cards we expect to
+        # see (e.g. the cards found in the hopper on the first pass). It's
+        # searched first, and the full index is only searched if the best
+        # candidate is further away than the fallback distance.
+        self.candidate_ids = None
+        self.candidate_id_set = None
+        self.candidate_index = None
+        self.fallback_distance = common.get_setting(
+            config, 'recognizer.candidates.fallback_distance', 0.25)
+        # When the sorter can predict which card is coming next, we just check
+        # that card's distance, and only search if it's further away than this.
+        self.verify_distance = common.get_setting(config,
+                                                  'recognizer.verify_distance')
+        # Recent results, keyed on a perceptual hash of the card's image.
+        self.cache = None
+        self.cache_path = common.get_setting(config,
+                                             'recognizer.cache.path',
+                                             'recognition_cache.npz')
+        # Only confident results are worth caching.
+        self.cache_max_distance = common.get_setting(
+            config, 'recognizer.cache.max_distance', 0.25)
+        if common.get_setting(config, 'recognizer.cache.enabled', False):
+            self.cache = recognition_cache.RecognitionCache(
+                capacity=common.get_setting(config,
+                                            'recognizer.cache.capacity', 4096),
+                max_hamming_distance=common.get_setting(
+                    config, 'recognizer.cache.max_hamming_distance', 12))
+            self.cache.load(self.cache_path)
+        sets = common.get_setting(config, 'recognizer.candidates.sets')
+        released_after = common.get_setting(
+            config, 'recognizer.candidates.released_after')
+        if sets is not None or released_after is not None:
+            self.set_candidates(
+                filter_catalog(catalog, sets=sets,
+                               released_after=released_after))
+
+    def embed(self, images):
+        """
+        Generates embeddings for a batch of preprocessed images. The batch size
+        must match the size the interpreter was allocated with.
+        """
         with prof_timer.PerfTimer('predict embedding'):
-            image = np.expand_dims(image, axis=0).astype(np.single)
             self.embedding_interpreter.set_tensor(
-                self.embedding_input_details['index'], image)
+                self.embedding_input_details['index'], images)
             self.embedding_interpreter.invoke()
-            target_embedding = self.embedding_interpreter.get_tensor(
-                self.embedding_output_details["index"])[0]
-        # Find the card with the nearest embedding vector.
+            return self.embedding_interpreter.get_tensor(
+                self.embedding_output_details["index"])
+
+    def set_candidates(self, card_ids):
+        """
+        Restricts the first stage of the search to `card_ids`. Pass None to go
+        back to searching the whole catalog.
+        """
+        if card_ids is None:
+            self.candidate_ids = None
+            self.candidate_id_set = None
+            self.candidate_index = None
+            return
+        rows = sorted(
+            set(self.rows_by_id[card_id] for card_id in card_ids
+                if card_id in self.rows_by_id))
+        if not rows:
+            # E.g. the embedding store is older than the catalog. There's
+            # nothing to restrict to, so keep searching the whole catalog.
+            print('None of the candidate cards have embeddings. Searching ' +
+                  'the whole catalog.')
+            self.candidate_ids = None
+            self.candidate_id_set = None
+            self.candidate_index = None
+            return
+        print(f'Restricting recognition to {len(rows)} candidate cards.')
+        self.candidate_ids = [self.card_ids[row] for row in rows]
+        self.candidate_id_set = set(self.candidate_ids)
+        # The sub-matrix is small enough to just copy in full precision.
+        self.candidate_index = embedding_index.BruteForceIndex(
+            np.asarray(self.embedding_matrix[rows], dtype=np.single))
+
+    def nearest(self, embeddings):
+        """Finds the nearest card id and distance for each embedding."""
         with prof_timer.PerfTimer('nearest'):
-            distances = 1 - np.dot(self.embedding_matrix,
-                                   np.squeeze(target_embedding))
-            nearest = np.argmin(distances)
-        distance = distances[nearest]
-        card_id = self.card_ids[nearest]
-        return card_id, distance
+            if self.candidate_index is not None:
+                nearest, distances = self.candidate_index.search(embeddings)
+                if np.min(distances) <= self.fallback_distance:
+                    return [(self.candidate_ids[n], d)
+                            for n, d in zip(nearest, distances)]
+            nearest, distances = self.index.search(embeddings)
+        return [(self.card_ids[n], d) for n, d in zip(nearest, distances)]
+
+    def match(self, embeddings, expected_card_id=None, verify_distance=None):
+        """
+        Finds the card matching the embeddings. If the expected card is within
+        the verify distance (`recognizer.verify_distance` unless given) of any
+        of the embeddings, it's accepted without searching. Returns a list of
+        (card_id, distance) candidates.
+        """
+        if verify_distance is None:
+            verify_distance = self.verify_distance
+        if (verify_distance is not None
+                and expected_card_id in self.rows_by_id):
+            with prof_timer.PerfTimer('verify'):
+                expected = np.asarray(
+                    self.embedding_matrix[self.rows_by_id[expected_card_id]],
+                    dtype=np.single)
+                distance = np.min(1 - np.dot(embeddings, expected))
+            if distance <= verify_distance:
+                return [(expected_card_id, distance)]
+        return self.nearest(embeddings)
+
+    def preprocess(self, image):
+        """
+        Fills `model_input` with the image, upright and rotated 180 degrees,
+        resized to the model's input size and scaled to [-1, 1] the same way
+        mobilenet_v2.preprocess_input does. Accepts uint8 images, or float
+        images in [0, 1].
+        """
+        image = np.asarray(image)
+        if image.dtype == np.uint8:
+            scale = 2 / 255
+        else:
+            image = image.astype(np.single)
+            scale = 2
+        height, width = self.image_dimensions
+        if image.shape[0:2] != (height, width):
+            image = cv2.resize(image, (width, height),
+                               interpolation=cv2.INTER_AREA)
+        np.multiply(image, scale, out=self.model_input[0], casting='unsafe')
+        self.model_input[0] -= 1
+        self.model_input[1] = self.model_input[0, ::-1, ::-1]
+
+    def save_cache(self):
+        if self.cache is not None:
+            self.cache.save(self.cache_path)
+
+    def is_candidate(self, card_id):
+        return (self.candidate_id_set is None
+                or card_id in self.candidate_id_set)
+
+    def recognize(self, large_image, expected_card_id=None):
+        verify_distance = None
+        cached = None
+        if self.cache is not None:
+            with prof_timer.PerfTimer('cache'):
+                cache_key = self.cache.key(large_image)
+                cached = self.cache.get(cache_key)
+            # Reprints with the same art have nearly the same hash, so a hit
+            # is only a candidate. It's accepted outright if it's the card we
+            # expected. Otherwise, if we weren't expecting anything, it's
+            # checked against the image's embedding like an expected card.
+            if cached is not None and cached[0] == expected_card_id:
+                return cached
+            if (cached is not None and expected_card_id is None
+                    and self.is_candidate(cached[0])):
+                expected_card_id = cached[0]
+                if self.verify_distance is None:
+                    verify_distance = self.cache_max_distance
+
+        # Scale the image values to what the network expects.
+        with prof_timer.PerfTimer('preprocess'):
+            self.preprocess(large_image)
+        upright = self.model_input[0:1]
+        inverted = self.model_input[1:2]
 
-    def recognize(self, large_image):
-        small_image = tf.image.resize(large_image,
-                                      self.image_dimensions,
-                                      antialias=True)
         # Recognize with the card upright and flipped 180.
         # Use the one with the smaller distance.
         with prof_timer.PerfTimer('embedding'):
-            upright = (self.recognize_by_embedding(small_image))
-            inverted = (self.recognize_by_embedding(
-                tf.image.rot90(small_image, k=2)))
+            if self.batch_size == 2:
+                # A single invoke and a single matrix-matrix product for both
+                # orientations.
+                results = self.match(self.embed(self.model_input),
+                                     expected_card_id, verify_distance)
+            else:
+                results = self.match(self.embed(upright), expected_card_id,
+                                     verify_distance)
+                if results[0][1] > self.early_exit_distance:
+                    results += self.match(self.embed(inverted),
+                                          expected_card_id, verify_distance)
 
-        orientation_index = np.argmin([upright[1], inverted[1]])
-        card_id, distance = (upright, inverted)[orientation_index]
+        card_id, distance = min(results, key=lambda result: result[1])
+        # If the hit was verified, looking it up already refreshed its entry,
+        # and adding another one with the same hash would just crowd out
+        # other cards.
+        if (self.cache is not None and distance <= self.cache_max_distance
+                and (cached is None or cached[0] != card_id)):
+            self.cache.put(cache_key, card_id, distance)
         return card_id, distance
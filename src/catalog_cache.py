@@ -0,0 +1,242 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+CATALOG_PATH = 'card_catalog.json'
+CACHE_PATH = 'card_catalog.cache.npz'
+CACHE_FORMAT_VERSION = 1
+
+# The only fields of the catalog that the sorter uses. Everything else in
+# card_catalog.json is dropped from the cache.
+FIELDS = [
+    'id', 'face_index', 'name', 'set', 'rarity', 'color_category', 'artist',
+    'illustration_id', 'full_art', 'released_at'
+]
+
+
+class CardRecord:
+    """
+    A read-only view of one card in the catalog. It can be used like the card's
+    dictionary from card_catalog.json, but only has the fields in FIELDS.
+    """
+    __slots__ = ('catalog', 'row')
+
+    def __init__(self, catalog, row):
+        self.catalog = catalog
+        self.row = row
+
+    def __getitem__(self, field):
+        if field not in self.catalog.columns:
+            raise KeyError(field)
+        return self.catalog.value(field, self.row)
+
+    def get(self, field, default=None):
+        if field not in self.catalog.columns:
+            return default
+        value = self.catalog.value(field, self.row)
+        return default if value is None else value
+
+    def keys(self):
+        return self.catalog.columns.keys()
+
+    def __contains__(self, field):
+        return field in self.catalog.columns
+
+    def __eq__(self, other):
+        return (isinstance(other, CardRecord) and self.catalog is other.catalog
+                and self.row == other.row)
+
+    def __hash__(self):
+        return hash(self.row)
+
+    def __repr__(self):
+        return repr({field: self[field] for field in self.keys()})
+
+
+class CardCatalog:
+    """
+    The card catalog, stored column by column. Each column is an array of
+    integer codes into a table of the column's distinct values, so repeated
+    strings (set codes, rarities, artists...) are only stored once.
+
+    It behaves like a read-only dictionary from card id
+    ('{scryfall id}_{face_index}') to CardRecord.
+    """
+    def __init__(self, card_ids, tables, codes, digest=None):
+        # The SHA-1 of card_catalog.json, which identifies this version of the
+        # catalog.
+        self.digest = digest
+        # field -> (table of distinct values, array of codes)
+        self.columns = {field: (tables[field], codes[field]) for field in tables}
+        self.length = len(card_ids)
+        self.rows_by_id = dict(zip(card_ids, range(len(card_ids))))
+
+    def value(self, field, row):
+        table, codes = self.columns[field]
+        return table[codes[row]]
+
+    def __getitem__(self, card_id):
+        return CardRecord(self, self.rows_by_id[card_id])
+
+    def __contains__(self, card_id):
+        return card_id in self.rows_by_id
+
+    def __len__(self):
+        return len(self.rows_by_id)
+
+    def __iter__(self):
+        return iter(self.rows_by_id)
+
+    def keys(self):
+        return self.rows_by_id.keys()
+
+    def values(self):
+        return (CardRecord(self, row) for row in self.rows_by_id.values())
+
+    def items(self):
+        return ((card_id, CardRecord(self, row))
+                for card_id, row in self.rows_by_id.items())
+
+    def records(self):
+        """Every card in the catalog, in the order of card_catalog.json."""
+        return RecordList(self)
+
+
+class RecordList:
+    """A lazy list of every card record, standing in for the raw catalog."""
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.length = catalog.length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, row):
+        if not 0 <= row < self.length:
+            raise IndexError(row)
+        return CardRecord(self.catalog, row)
+
+    def __iter__(self):
+        return (CardRecord(self.catalog, row) for row in range(self.length))
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as catalog_file:
+        for block in iter(lambda: catalog_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_columns(catalog):
+    """
+    Dictionary-encodes each of the FIELDS in the raw catalog. Returns the card
+    id of every row, the table of distinct values for each field, and the
+    array of codes for each field.
+    """
+    card_ids = [f'{card["id"]}_{card["face_index"]}' for card in catalog]
+    tables = {}
+    codes = {}
+    for field in FIELDS:
+        code_for_value = {}
+        field_codes = np.empty(len(catalog), dtype=np.int32)
+        for row, card in enumerate(catalog):
+            field_codes[row] = code_for_value.setdefault(
+                card.get(field), len(code_for_value))
+        tables[field] = list(code_for_value.keys())
+        codes[field] = field_codes
+    return card_ids, tables, codes
+
+
+def intern_tables(tables):
+    # The ids are all unique, so there's nothing to gain by interning them.
+    return {
+        field: table if field == 'id' else
+        [sys.intern(v) if isinstance(v, str) else v for v in table]
+        for field, table in tables.items()
+    }
+
+
+def save_cache(path, metadata, card_ids, tables, codes):
+    np.savez(path,
+             metadata=json.dumps(metadata),
+             card_ids=json.dumps(card_ids),
+             tables=json.dumps(tables),
+             **{f'codes_{field}': codes[field]
+                for field in FIELDS})
+
+
+def read_cache(path):
+    """
+    Returns (metadata, card_ids, tables, codes), or None if there's no usable
+    cache.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        metadata = json.loads(str(data['metadata']))
+        if metadata.get('format_version') != CACHE_FORMAT_VERSION:
+            return None
+        card_ids = json.loads(str(data['card_ids']))
+        tables = json.loads(str(data['tables']))
+        codes = {field: data[f'codes_{field}'] for field in FIELDS}
+    return metadata, card_ids, tables, codes
+
+
+def load_catalog(catalog_path=CATALOG_PATH, cache_path=CACHE_PATH):
+    """
+    Loads the card catalog, from the cache if it's up to date with the JSON
+    file, otherwise from the JSON file (and then rebuilds the cache).
+
+    The cache is considered up to date if the JSON file's size and modification
+    time match. If they don't, the JSON file is hashed, and the cache is still
+    used if the hash matches.
+    """
+    stat = os.stat(catalog_path)
+    cached = read_cache(cache_path)
+    if cached is not None:
+        metadata, card_ids, tables, codes = cached
+        if (metadata['size'] == stat.st_size
+                and metadata['mtime'] == stat.st_mtime):
+            return CardCatalog(card_ids, intern_tables(tables), codes,
+                               metadata['sha1'])
+        digest = file_digest(catalog_path)
+        if metadata['sha1'] == digest:
+            metadata.update(size=stat.st_size, mtime=stat.st_mtime)
+            save_cache(cache_path, metadata, card_ids, tables, codes)
+            return CardCatalog(card_ids, intern_tables(tables), codes, digest)
+    else:
+        digest = file_digest(catalog_path)
+
+    print(f'Building catalog cache from {catalog_path}. ' +
+          'This only happens when the catalog changes.')
+    with open(catalog_path, 'r', encoding='utf-8') as json_file:
+        catalog = json.load(json_file)
+    card_ids, tables, codes = build_columns(catalog)
+    metadata = {
+        'format_version': CACHE_FORMAT_VERSION,
+        'sha1': digest,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+    }
+    save_cache(cache_path, metadata, card_ids, tables, codes)
+    return CardCatalog(card_ids, intern_tables(tables), codes, digest)
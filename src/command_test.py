@@ -32,6 +32,10 @@ print(f'{BOLD}q:{UNBOLD} quit')
 print(f'{BOLD}f:{UNBOLD} feed next card')
 print(f'{BOLD}l:{UNBOLD} send card left')
 print(f'{BOLD}r:{UNBOLD} send card right')
+print(f'{BOLD}n:{UNBOLD} feed next card, unless the hopper is empty')
+print(f'{BOLD}L:{UNBOLD} send card left, then feed the next card')
+print(f'{BOLD}R:{UNBOLD} send card right, then feed the next card')
+print(f'{BOLD}0-9:{UNBOLD} send card to that tray (0 is left, 1 is right)')
 print(f'{BOLD}\\:{UNBOLD} reset hopper (after reloading)')
 
 while True:
@@ -45,6 +49,19 @@ while True:
         common.send_command(serial_port, 'send_left')
     elif command == 'r':
         common.send_command(serial_port, 'send_right')
+    elif command in ['n', 'L', 'R']:
+        compound_command = {
+            'n': 'next_if_not_empty',
+            'L': 'send_left_then_next',
+            'R': 'send_right_then_next'
+        }[command]
+        result, _ = common.send_command(serial_port, compound_command)
+        print(f'Result: {result}')
+    elif command.isdigit():
+        try:
+            common.send_command(serial_port, f'send {command}')
+        except common.DeviceError as error:
+            print(error)
     elif command == '\\':
         common.send_command(serial_port, 'reset_hopper')
     else:
@@ -19,6 +19,8 @@ import re
 import serial
 import time
 
+import catalog_cache
+
 from dataclasses import dataclass
 from types import SimpleNamespace
 
@@ -29,11 +31,28 @@ def load_config():
                          object_hook=lambda x: SimpleNamespace(**x))
 
 
+def get_setting(config, path, default=None):
+    """
+    Looks up an optional, dot-separated setting (e.g. 'recognizer.index.type')
+    in the config. Returns `default` if any part of the path is missing.
+    """
+    value = config
+    for name in path.split('.'):
+        value = getattr(value, name, None)
+        if value is None:
+            return default
+    return value
+
+
 def save_config(config):
     with open("config.json", "w") as config_file:
         return json.dump(config, config_file, indent=4, sort_keys=True)
 
 
+class DeviceError(Exception):
+    """The device replied to a command with an error."""
+
+
 def send_command(serial_port, command):
     @dataclass
     class SensorValues:
@@ -46,7 +65,8 @@ def send_command(serial_port, command):
     # The device handles commands synchronously. Don't send a new command until
     # the device has responded to the last one.
     # The device may send 'done', 'empty', 'not_empty', or 'query: ...' as
-    # responses.
+    # responses, or 'error: ...' if it couldn't carry out the command, which
+    # raises a DeviceError.
     #
     # Anything else is a log statement that may be informative, but can also
     # be safely ignored.
@@ -59,6 +79,9 @@ def send_command(serial_port, command):
             pass
         elif decoded_line in ['done', 'empty', 'not_empty']:
             return decoded_line, log
+        elif decoded_line.startswith('error:'):
+            raise DeviceError(
+                f'{command}: {decoded_line[len("error:"):].strip()}')
         elif decoded_line.startswith('query:'):
             match_dict = re.fullmatch(
                 'query: (?P<primary>[0-9]+), (?P<secondary>[0-9]+), ' +
@@ -81,10 +104,15 @@ def to_dictionary(obj):
 
 def open_device(config):
     port = config.serial_port
-    print(f'Opening serial port: {port}')
-    serial_port = serial.Serial(port, timeout=1)
-    print('Port open. Waiting for device to boot.')
-    time.sleep(5)
+    if port == 'emulator':
+        import device_emulator
+        print('Using the emulated device.')
+        serial_port = device_emulator.get_emulator(config)
+    else:
+        print(f'Opening serial port: {port}')
+        serial_port = serial.Serial(port, timeout=1)
+        print('Port open. Waiting for device to boot.')
+        time.sleep(5)
     print('Sending device config.')
     device_config = json.dumps(to_dictionary(config.device_config))
     result, log = send_command(serial_port, f'initialize\n{device_config}\n')
@@ -99,12 +127,9 @@ def load_catalog():
     # cards_by_id is a dictionary mapping cards by their id.
     # I use the format '{scryfall id}_{face_index}' for all cards.
     # Single-faced cards have only one face_index (0).
-    with open("card_catalog.json", "r", encoding="utf-8") as json_file:
-        catalog = json.load(json_file)
-    cards_by_id = dict()
-    for card in catalog:
-        id = card['id']
-        face_index = card['face_index']
-        card_id = f'{id}_{face_index}'
-        cards_by_id[card_id] = card
-    return catalog, cards_by_id
+    #
+    # Parsing card_catalog.json takes a long time, so the fields we use are
+    # cached in a compact, column-oriented form. The cards are returned as
+    # lightweight, read-only records rather than dictionaries.
+    cards_by_id = catalog_cache.load_catalog()
+    return cards_by_id.records(), cards_by_id
@@ -0,0 +1,29 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+# Converts embedding_dictionary.pickle into the memory-mapped embedding store.
+# Re-run this whenever you download a new embedding model and dictionary.
+
+import common
+import embedding_store
+
+config = common.load_config()
+dtype = common.get_setting(config, 'recognizer.embedding_store.dtype',
+                           'float32')
+print(f'Converting {embedding_store.PICKLE_PATH} to {dtype}.')
+metadata = embedding_store.convert_pickle(embedding_store.MODEL_PATH, dtype)
+print(f'Wrote {metadata["count"]} embeddings of size ' +
+      f'{metadata["dimension"]} to {embedding_store.MATRIX_PATH}')
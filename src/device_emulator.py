@@ -0,0 +1,359 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+# An emulator of the sorting machine, so the sorting software can be run and
+# benchmarked without the Arduino or the camera. Set `serial_port` and
+# `camera_id` in config.json to "emulator" to use it.
+
+import collections
+import json
+import os
+import random
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import common
+
+FRAME_WIDTH = 1280
+FRAME_HEIGHT = 720
+FRAMES_PER_SECOND = 30
+# Where the card sits in the frame, and its size. The camera is mounted so the
+# card is sideways in the frame.
+CARD_WIDTH = 900
+CARD_HEIGHT = 630
+BACKGROUND = 96
+
+# Emulated mechanical delays, in seconds.
+DEFAULT_DELAYS = {
+    # Feeding a card from the hopper into the tray.
+    'feed': 0.6,
+    # Sending the card in the tray into a basket.
+    'send': 0.5,
+    # Waiting for the hopper and tray to come to rest before answering whether
+    # the hopper is empty.
+    'query': 0.05,
+    # How long the card keeps sliding in the tray after "done".
+    'slide': 0.15,
+    # The operator moving the baskets back into the hopper.
+    'reload': 20,
+}
+
+# The two-tray commands are the same as sending to tray 0 or 1.
+TWO_TRAY_COMMANDS = {
+    'send_left': 'send 0',
+    'send_right': 'send 1',
+    'send_left_then_next': 'send_then_next 0',
+    'send_right_then_next': 'send_then_next 1',
+}
+
+_emulator = None
+
+
+def get_emulator(config):
+    """Returns the emulator shared by the emulated serial port and camera."""
+    global _emulator
+    if _emulator is None:
+        _emulator = MachineEmulator(config)
+    return _emulator
+
+
+def scan_paths(scans_dir):
+    """Returns {card id: path} for the scans in the directory."""
+    paths = {}
+    if not os.path.isdir(scans_dir):
+        return paths
+    for file in os.scandir(scans_dir):
+        card_id, extension = os.path.splitext(file.name)
+        if file.is_file() and extension.lower() in ['.jpg', '.jpeg', '.png']:
+            paths[card_id] = file.path
+    return paths
+
+
+def build_deck(config, card_ids):
+    """
+    Returns the card ids in the hopper, in feed order. `emulator.deck` can
+    name a file with one card id per line. Otherwise `emulator.deck_size` cards
+    are drawn from the cards that have scans (one of each by default), with
+    copies if there are more cards than scans.
+    """
+    deck_path = common.get_setting(config, 'emulator.deck')
+    if deck_path is not None:
+        with open(deck_path, 'r', encoding='utf-8') as deck_file:
+            return [line.strip() for line in deck_file if line.strip()]
+    rng = random.Random(common.get_setting(config, 'emulator.seed', 0))
+    deck_size = common.get_setting(config, 'emulator.deck_size')
+    card_ids = sorted(card_ids)
+    if deck_size is None or deck_size <= len(card_ids):
+        deck = rng.sample(card_ids, deck_size or len(card_ids))
+    else:
+        deck = card_ids + rng.choices(card_ids, k=deck_size - len(card_ids))
+    rng.shuffle(deck)
+    return deck
+
+
+class MachineEmulator:
+    """
+    Emulates the card_sorter.ino firmware, along with the mechanics it drives,
+    behind an object that behaves enough like a serial.Serial to be used by
+    common.send_command.
+
+    Commands are answered after the configured mechanical delay, plus the time
+    it takes to transmit the command and reply at `emulator.baud_rate`. All
+    delays are divided by `emulator.speed`, so the machine can be run faster
+    than real time. The emulated machine time that has passed is kept in
+    `machine_time`, and the real time spent waiting for it in `waited_time`.
+
+    When the sorter asks whether the hopper has been reloaded, the emulated
+    operator puts the left basket and then the right basket back into the
+    hopper, the way the README says to. With `tray_count` set to more than two,
+    the machine has that many output trays, which are put back in order.
+    """
+    def __init__(self, config):
+        self.timeout = 1
+        self.speed = common.get_setting(config, 'emulator.speed', 1)
+        self.baud_rate = common.get_setting(config, 'emulator.baud_rate',
+                                            9600)
+        self.delays = dict(DEFAULT_DELAYS)
+        delays = common.get_setting(config, 'emulator.delays')
+        if delays is not None:
+            self.delays.update(common.to_dictionary(delays))
+
+        self.scans = scan_paths(
+            common.get_setting(config, 'emulator.scans', 'emulator_scans'))
+        self.hopper = collections.deque(build_deck(config, self.scans.keys()))
+        self.tray = None
+        self.tray_count = common.get_setting(config, 'tray_count', 2)
+        # The cards in each output tray, in the order they arrived. Tray 0 is
+        # the left basket and tray 1 the right.
+        self.baskets = [[] for _ in range(self.tray_count)]
+        # When the card in the tray arrived, in real time.
+        self.arrival_time = 0
+
+        self.machine_time = 0
+        self.waited_time = 0
+        self.reload_time = 0
+        self.pending_input = ''
+        self.replies = collections.deque()
+        self.lock = threading.Lock()
+
+    # The serial.Serial interface.
+
+    def write(self, data):
+        self.pending_input += data.decode('utf-8')
+        while '\n' in self.pending_input:
+            line, self.pending_input = self.pending_input.split('\n', 1)
+            if line == 'initialize':
+                # The device config follows on its own line.
+                if '\n' not in self.pending_input:
+                    self.pending_input = line + '\n' + self.pending_input
+                    return
+                device_config, self.pending_input = self.pending_input.split(
+                    '\n', 1)
+                json.loads(device_config)
+                self.reply('Deserialization succeeded.', 0, len(line))
+                self.reply('done', 0, len(device_config))
+            elif line:
+                self.run_command(line)
+
+    def readline(self):
+        if not self.replies:
+            time.sleep(self.timeout)
+            return b''
+        delay, line = self.replies.popleft()
+        self.wait(delay)
+        return (line + '\r\n').encode('utf-8')
+
+    def close(self):
+        pass
+
+    # The emulated machine.
+
+    def reply(self, line, delay, command_length=0):
+        """Queues a reply that arrives `delay` machine seconds from now."""
+        bits = (command_length + 1 + len(line) + 2) * 10
+        self.replies.append((delay + bits / self.baud_rate, line))
+
+    def wait(self, delay):
+        self.machine_time += delay
+        start = time.monotonic()
+        time.sleep(delay / self.speed)
+        self.waited_time += time.monotonic() - start
+
+    def feed(self, lead_time=0):
+        """
+        Feeds the next card into the tray, after `lead_time` machine seconds.
+        """
+        with self.lock:
+            self.tray = self.hopper.popleft()
+            # The card arrives at the end of the feed delay, and keeps sliding
+            # after that. The replies are read in order, so the feed starts
+            # once any earlier replies have been read.
+            self.arrival_time = time.monotonic() + (
+                sum(delay for delay, _ in self.replies) + lead_time +
+                self.delays['feed']) / self.speed
+
+    def send(self, tray):
+        with self.lock:
+            if self.tray is not None:
+                self.baskets[tray].append(self.tray)
+                self.tray = None
+
+    def run_command(self, command):
+        length = len(command)
+        name, _, argument = TWO_TRAY_COMMANDS.get(command,
+                                                  command).partition(' ')
+        if name in ['send', 'send_then_next']:
+            # Like the firmware, leave the card where it is and reply with an
+            # error rather than "done".
+            if not argument.isdigit() or int(argument) >= self.tray_count:
+                self.reply(f'error: no such tray: {argument}', 0, length)
+                return
+            tray = int(argument)
+        if name == 'send':
+            self.send(tray)
+            self.reply('done', self.delays['send'], length)
+        elif command == 'next_card':
+            if not self.hopper:
+                # The real machine never replies when there are no cards to
+                # feed.
+                self.reply('Secondary Hopper: ready_to_fill -> empty', 0,
+                           length)
+                return
+            self.feed()
+            self.reply('done', self.delays['feed'], length)
+        elif command == 'is_hopper_empty':
+            self.reply('empty' if not self.hopper else 'not_empty',
+                       self.delays['query'], length)
+        elif name in ['next_if_not_empty', 'send_then_next']:
+            delay = self.delays['query']
+            if name == 'send_then_next':
+                self.send(tray)
+                delay += self.delays['send']
+            if not self.hopper:
+                self.reply('empty', delay, length)
+            else:
+                self.feed(lead_time=delay)
+                self.reply('done', delay + self.delays['feed'], length)
+        elif command == 'is_hopper_reloaded':
+            if not self.hopper and any(self.baskets):
+                for basket in self.baskets:
+                    self.hopper.extend(basket)
+                self.baskets = [[] for _ in range(self.tray_count)]
+                self.reload_time += self.delays['reload']
+                self.machine_time += self.delays['reload']
+            self.reply('not_empty' if self.hopper else 'empty', 0, length)
+        elif command == 'query_sensors':
+            # The sensors read 0 when they're blocked by a card.
+            hopper = 0 if self.hopper else 1
+            tray = 0 if self.tray is not None else 1
+            self.reply(f'query: {hopper}, {hopper}, 0, {tray}, {tray}', 0,
+                       length)
+        else:
+            # start, reset_hopper and the motor tests.
+            self.reply('done', 0, length)
+
+    def card_in_tray(self):
+        """Returns (card id, seconds since it arrived) for the tray."""
+        with self.lock:
+            return self.tray, time.monotonic() - self.arrival_time
+
+    def print(self):
+        baskets = ', '.join(str(len(basket)) for basket in self.baskets)
+        print(f'Emulator: {len(self.hopper)} cards in the hopper, ' +
+              f'[{baskets}] in the output trays, ' +
+              f'{self.machine_time:.1f}s of machine time')
+
+
+class VirtualCamera:
+    """
+    Stands in for a cv2.VideoCapture. It serves frames at 30 frames per second
+    showing the scan of whichever card is in the emulated tray, sliding to a
+    stop after it arrives.
+
+    Scans are read from the `emulator.scans` directory, named by card id (e.g.
+    `<scryfall id>_0.jpg`). A scan can be a full 1280x720 camera frame, e.g.
+    one saved by camera_mode.py, or an upright image of just the card, which is
+    placed in the middle of the frame.
+    """
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self.background = np.full((FRAME_HEIGHT, FRAME_WIDTH, 3),
+                                  BACKGROUND,
+                                  dtype=np.uint8)
+        self.frames = {}
+        self.next_frame_time = time.monotonic()
+        self.opened = True
+
+    def card_frame(self, card_id):
+        """Returns the BGR frame with the card at rest in the tray."""
+        if card_id not in self.frames:
+            path = self.emulator.scans.get(card_id)
+            scan = cv2.imread(path) if path is not None else None
+            if scan is None:
+                print(f'Emulator: no scan for {card_id}')
+                frame = self.background.copy()
+            elif scan.shape[:2] == (FRAME_HEIGHT, FRAME_WIDTH):
+                frame = scan
+            else:
+                card = cv2.rotate(scan, cv2.ROTATE_90_CLOCKWISE)
+                card = cv2.resize(card, (CARD_WIDTH, CARD_HEIGHT),
+                                  interpolation=cv2.INTER_AREA)
+                frame = self.background.copy()
+                left = (FRAME_WIDTH - CARD_WIDTH) // 2
+                top = (FRAME_HEIGHT - CARD_HEIGHT) // 2
+                frame[top:top + CARD_HEIGHT, left:left + CARD_WIDTH] = card
+            self.frames[card_id] = frame
+        return self.frames[card_id]
+
+    def read(self):
+        # Pace the frames like a real camera.
+        now = time.monotonic()
+        if self.next_frame_time > now:
+            time.sleep(self.next_frame_time - now)
+        self.next_frame_time = max(now, self.next_frame_time) + (
+            1 / FRAMES_PER_SECOND)
+
+        card_id, since_arrival = self.emulator.card_in_tray()
+        if card_id is None or since_arrival < 0:
+            return True, self.background.copy()
+        frame = self.card_frame(card_id)
+        slide = self.emulator.delays['slide'] / self.emulator.speed
+        if since_arrival >= slide:
+            return True, frame.copy()
+        # Still sliding: offset the card along the tray, slowing to a stop.
+        remaining = 1 - since_arrival / slide
+        offset = int(FRAME_HEIGHT * 0.25 * remaining * remaining)
+        shift = np.float32([[1, 0, 0], [0, 1, offset]])
+        return True, cv2.warpAffine(frame,
+                                    shift, (FRAME_WIDTH, FRAME_HEIGHT),
+                                    borderValue=(BACKGROUND, ) * 3)
+
+    def isOpened(self):
+        return self.opened
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return FRAMES_PER_SECOND
+        return 0
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        self.opened = False
@@ -0,0 +1,198 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+
+import numpy as np
+
+import common
+
+# Bump this whenever the on-disk layout of a saved index changes.
+INDEX_FORMAT_VERSION = 1
+
+
+def card_ids_digest(card_ids):
+    """A fingerprint of the card id table, used to detect stale indexes."""
+    return hashlib.sha1('\n'.join(card_ids).encode('utf-8')).hexdigest()
+
+
+def cosine_distances(matrix, queries):
+    """
+    Returns the (num_queries, num_rows) matrix of cosine distances between the
+    queries and the rows of the matrix. The embeddings are unit length, so the
+    cosine distance is just 1 - dot product.
+    """
+    if matrix.dtype == np.single:
+        return 1 - np.dot(queries, matrix.T)
+    # Half precision matrices are converted a block at a time, so we never hold
+    # a full precision copy of the whole matrix.
+    BLOCK_SIZE = 16384
+    distances = np.empty((len(queries), len(matrix)), dtype=np.single)
+    for start in range(0, len(matrix), BLOCK_SIZE):
+        block = matrix[start:start + BLOCK_SIZE].astype(np.single)
+        distances[:, start:start + BLOCK_SIZE] = 1 - np.dot(queries, block.T)
+    return distances
+
+
+class BruteForceIndex:
+    """Exact nearest neighbour search. Compares the query against every card."""
+    def __init__(self, embedding_matrix):
+        self.embedding_matrix = embedding_matrix
+
+    def search(self, queries):
+        """
+        Finds the nearest card for each row of `queries`. Returns a tuple of
+        (row indices, distances), one entry per query.
+        """
+        distances = cosine_distances(self.embedding_matrix, queries)
+        nearest = np.argmin(distances, axis=1)
+        return nearest, distances[np.arange(len(nearest)), nearest]
+
+
+class IvfIndex:
+    """
+    An inverted file index. The embeddings are clustered with (spherical)
+    k-means. At query time we only look at the cards in the few clusters whose
+    centroids are nearest to the query, and score those candidates exactly,
+    in full precision.
+
+    The cards are grouped into `num_lists` lists. `list_members` holds the
+    embedding matrix row indices of every card, grouped by list, and
+    `list_offsets[i]:list_offsets[i + 1]` is the slice of `list_members` that
+    belongs to list i.
+    """
+    def __init__(self, embedding_matrix, centroids, list_offsets, list_members,
+                 num_probes):
+        self.embedding_matrix = embedding_matrix
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_members = list_members
+        self.num_probes = min(num_probes, len(centroids))
+
+    @staticmethod
+    def build(embedding_matrix,
+              num_lists,
+              num_probes,
+              iterations=10,
+              samples_per_list=64,
+              seed=0):
+        rng = np.random.default_rng(seed)
+        num_lists = min(num_lists, len(embedding_matrix))
+        # Train the centroids on a sample of the catalog. It's much faster and
+        # the centroids come out nearly the same.
+        sample_size = min(len(embedding_matrix), num_lists * samples_per_list)
+        sample = embedding_matrix[rng.choice(len(embedding_matrix),
+                                             sample_size,
+                                             replace=False)].astype(np.single)
+        centroids = sample[rng.choice(sample_size, num_lists, replace=False)]
+        for _ in range(iterations):
+            assignments = np.argmax(np.dot(sample, centroids.T), axis=1)
+            for i in range(num_lists):
+                members = sample[assignments == i]
+                if len(members) == 0:
+                    # Re-seed empty clusters with a random sample.
+                    centroids[i] = sample[rng.integers(sample_size)]
+                else:
+                    centroids[i] = members.sum(axis=0)
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+
+        # Assign every card to its nearest centroid, in chunks to bound the
+        # size of the temporary score matrix.
+        assignments = np.empty(len(embedding_matrix), dtype=np.int32)
+        CHUNK_SIZE = 8192
+        for start in range(0, len(embedding_matrix), CHUNK_SIZE):
+            chunk = embedding_matrix[start:start + CHUNK_SIZE]
+            scores = np.dot(chunk.astype(np.single), centroids.T)
+            assignments[start:start + CHUNK_SIZE] = np.argmax(scores, axis=1)
+        list_members = np.argsort(assignments, kind='stable').astype(np.int32)
+        list_offsets = np.searchsorted(assignments[list_members],
+                                       np.arange(num_lists + 1))
+        list_offsets = list_offsets.astype(np.int32)
+        return IvfIndex(embedding_matrix, centroids, list_offsets,
+                        list_members, num_probes)
+
+    def save(self, path, card_ids):
+        np.savez(path,
+                 format_version=INDEX_FORMAT_VERSION,
+                 card_ids_digest=card_ids_digest(card_ids),
+                 centroids=self.centroids,
+                 list_offsets=self.list_offsets,
+                 list_members=self.list_members)
+
+    @staticmethod
+    def load(path, embedding_matrix, card_ids, num_probes):
+        """Loads a saved index. Returns None if it's missing or out of date."""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if int(data['format_version']) != INDEX_FORMAT_VERSION:
+                return None
+            if str(data['card_ids_digest']) != card_ids_digest(card_ids):
+                return None
+            return IvfIndex(embedding_matrix, data['centroids'],
+                            data['list_offsets'], data['list_members'],
+                            num_probes)
+
+    def candidates(self, query):
+        """The embedding matrix rows in the lists nearest to the query."""
+        scores = np.dot(self.centroids, query)
+        probes = np.argpartition(-scores, self.num_probes - 1)[:self.num_probes]
+        return np.concatenate([
+            self.list_members[self.list_offsets[p]:self.list_offsets[p + 1]]
+            for p in probes
+        ])
+
+    def search(self, queries):
+        nearest = np.empty(len(queries), dtype=np.int64)
+        distances = np.empty(len(queries), dtype=np.single)
+        for i, query in enumerate(queries):
+            candidates = self.candidates(query)
+            candidate_distances = cosine_distances(
+                self.embedding_matrix[candidates], query[np.newaxis])[0]
+            best = np.argmin(candidate_distances)
+            nearest[i] = candidates[best]
+            distances[i] = candidate_distances[best]
+        return nearest, distances
+
+
+def load_index(config, embedding_matrix, card_ids):
+    """
+    Creates the nearest neighbour index selected by `recognizer.index` in the
+    config. An IVF index is built the first time it's needed and saved so that
+    later runs can just load it.
+    """
+    index_type = common.get_setting(config, 'recognizer.index.type',
+                                    'brute_force')
+    if index_type == 'brute_force':
+        return BruteForceIndex(embedding_matrix)
+    elif index_type == 'ivf':
+        path = common.get_setting(config, 'recognizer.index.path',
+                                  'embedding_index.npz')
+        num_lists = common.get_setting(config, 'recognizer.index.num_lists',
+                                       256)
+        num_probes = common.get_setting(config, 'recognizer.index.num_probes',
+                                        8)
+        index = IvfIndex.load(path, embedding_matrix, card_ids, num_probes)
+        if index is None:
+            print(f'Building IVF index with {num_lists} lists. ' +
+                  'This only happens once.')
+            index = IvfIndex.build(embedding_matrix, num_lists, num_probes)
+            index.save(path, card_ids)
+            print(f'Saved IVF index to {path}')
+        return index
+    else:
+        raise ValueError(f'Unknown embedding index type: {index_type}')
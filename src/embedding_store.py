@@ -0,0 +1,112 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+
+# The embedding store is three files:
+#  - embeddings.npy: A contiguous (num_cards, embedding_size) matrix, which is
+#    memory-mapped rather than read, so startup is nearly instant and multiple
+#    processes on the same machine share the same pages.
+#  - embedding_ids.txt: The card id of each row, one per line.
+#  - embedding_store.json: Metadata used to make sure the store matches the
+#    embedding model it's used with.
+MODEL_PATH = 'embedding_model.tflite'
+MATRIX_PATH = 'embeddings.npy'
+IDS_PATH = 'embedding_ids.txt'
+METADATA_PATH = 'embedding_store.json'
+PICKLE_PATH = 'embedding_dictionary.pickle'
+
+STORE_FORMAT_VERSION = 1
+
+
+def model_digest(model_path):
+    """A fingerprint of the embedding model the embeddings were made with."""
+    with open(model_path, 'rb') as model_file:
+        return hashlib.sha1(model_file.read()).hexdigest()
+
+
+def convert_pickle(model_path, dtype='float32'):
+    """
+    Converts the embedding dictionary pickle into the embedding store, with the
+    embeddings stored as `dtype` (float32 or float16).
+    """
+    with open(PICKLE_PATH, 'rb') as handle:
+        embedding_dictionary = pickle.load(handle)
+    card_ids = list(embedding_dictionary.keys())
+    matrix = np.array(list(embedding_dictionary.values()), dtype=dtype)
+    np.save(MATRIX_PATH, matrix)
+    with open(IDS_PATH, 'w', encoding='utf-8') as ids_file:
+        ids_file.write('\n'.join(card_ids))
+    metadata = {
+        'format_version': STORE_FORMAT_VERSION,
+        'count': len(card_ids),
+        'dimension': matrix.shape[1],
+        'dtype': str(matrix.dtype),
+        'model_digest': model_digest(model_path),
+    }
+    with open(METADATA_PATH, 'w') as metadata_file:
+        json.dump(metadata, metadata_file, indent=4, sort_keys=True)
+    return metadata
+
+
+def check_metadata(metadata, model_path, embedding_size):
+    """Raises if the store doesn't match the model it's being loaded with."""
+    if metadata['format_version'] != STORE_FORMAT_VERSION:
+        raise ValueError(
+            f'Embedding store format {metadata["format_version"]} is not ' +
+            'supported. Re-run convert_embeddings.py.')
+    if embedding_size is not None and metadata['dimension'] != embedding_size:
+        raise ValueError(
+            'Embedding store has embeddings of size ' +
+            f'{metadata["dimension"]}, but {model_path} produces ' +
+            f'embeddings of size {embedding_size}.')
+    if metadata['model_digest'] != model_digest(model_path):
+        raise ValueError(
+            f'Embedding store was made with a different {model_path}. ' +
+            'Re-run convert_embeddings.py with the matching ' +
+            'embedding_dictionary.pickle.')
+
+
+def load_embeddings(model_path, embedding_size=None):
+    """
+    Returns (card_ids, embedding_matrix). Uses the memory-mapped embedding store
+    if there is one, otherwise falls back to the embedding dictionary pickle.
+    The embedding size check is skipped if `embedding_size` is None.
+    """
+    if not os.path.exists(METADATA_PATH):
+        print(f'No embedding store found, loading {PICKLE_PATH}. ' +
+              'Run convert_embeddings.py for faster startup.')
+        with open(PICKLE_PATH, 'rb') as handle:
+            embedding_dictionary = pickle.load(handle)
+        return (list(embedding_dictionary.keys()),
+                np.array(list(embedding_dictionary.values())))
+
+    with open(METADATA_PATH, 'r') as metadata_file:
+        metadata = json.load(metadata_file)
+    check_metadata(metadata, model_path, embedding_size)
+    with open(IDS_PATH, 'r', encoding='utf-8') as ids_file:
+        card_ids = ids_file.read().split('\n')
+    matrix = np.load(MATRIX_PATH, mmap_mode='r')
+    expected_shape = (metadata['count'], metadata['dimension'])
+    if matrix.shape != expected_shape or len(card_ids) != metadata['count']:
+        raise ValueError('Embedding store is corrupt. ' +
+                         'Re-run convert_embeddings.py.')
+    return card_ids, matrix
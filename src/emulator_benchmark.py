@@ -0,0 +1,110 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+# Runs a complete sorting session against the emulated machine and camera (see
+# device_emulator.py), and reports how long each pass would have taken on the
+# real machine.
+#
+# The `emulator` settings in config.json control the emulated deck, delays and
+# speed. The reported times are the emulated machine time plus the time the
+# software spent on its own work. At emulator.speed 1 that's exactly the wall
+# clock time. At higher speeds, it assumes none of the software's work would
+# have overlapped with the machine moving, so it slightly overestimates.
+
+import asyncio
+import os
+import tempfile
+import time
+
+import async_device
+import card_comparison
+import common
+import device_emulator
+import prof_timer
+import sort_session
+
+config = common.load_config()
+prof_timer.configure(config)
+config.serial_port = 'emulator'
+config.camera_id = 'emulator'
+# Don't let the benchmark read or overwrite the real recognition cache.
+cache_dir = tempfile.mkdtemp()
+if common.get_setting(config, 'recognizer.cache') is not None:
+    config.recognizer.cache.path = os.path.join(cache_dir, 'cache.npz')
+
+print('Loading catalog')
+catalog, cards_by_id = common.load_catalog()
+
+emulator = device_emulator.get_emulator(config)
+if not emulator.hopper:
+    print('The emulated hopper is empty. Put scans of cards, named by card ' +
+          'id, in the emulator.scans directory, or list card ids in an ' +
+          'emulator.deck file.')
+    raise SystemExit(1)
+deck = list(emulator.hopper)
+print(f'Emulated deck: {len(deck)} cards')
+
+device = async_device.AsyncSorter(config, catalog, cards_by_id)
+
+passes = []
+checkpoint = {}
+
+
+def checkpoint_times():
+    checkpoint['wall'] = time.monotonic()
+    checkpoint['waited'] = emulator.waited_time
+    checkpoint['machine'] = emulator.machine_time - emulator.reload_time
+
+
+def on_pass_complete(pass_number, card_count):
+    software = (time.monotonic() - checkpoint['wall'] -
+                (emulator.waited_time - checkpoint['waited']))
+    machine = (emulator.machine_time - emulator.reload_time -
+               checkpoint['machine'])
+    passes.append((pass_number, card_count, machine, software))
+    checkpoint_times()
+
+
+checkpoint_times()
+asyncio.run(sort_session.sort(device, cards_by_id, config, on_pass_complete))
+emulator.print()
+device.close()
+
+print()
+print(f'{"pass":>4} {"cards":>6} {"machine s":>10} {"software s":>11} ' +
+      f'{"total s":>8} {"cards/hour":>11}')
+for pass_number, card_count, machine, software in passes:
+    total = machine + software
+    rate = card_count / total * 3600 if total > 0 else 0
+    print(f'{pass_number:>4} {card_count:>6} {machine:>10.1f} ' +
+          f'{software:>11.1f} {total:>8.1f} {rate:>11.0f}')
+machine = sum(p[2] for p in passes)
+software = sum(p[3] for p in passes)
+cards = sum(p[1] for p in passes)
+total = machine + software
+print(f'{"all":>4} {cards:>6} {machine:>10.1f} {software:>11.1f} ' +
+      f'{total:>8.1f} {cards / total * 3600 if total > 0 else 0:>11.0f}')
+print(f'Plus {emulator.reload_time:.0f}s for the operator to reload the ' +
+      f'hopper {len(passes) - 1} times.')
+
+# The sorted stack is the left basket followed by the right basket, or all the
+# output trays in order.
+result = [card_id for basket in emulator.baskets for card_id in basket]
+comparer = card_comparison.CardComparer(cards_by_id)
+out_of_order = sum(
+    comparer.less(second, first) for first, second in zip(result, result[1:]))
+print(f'Final stack: {len(result)} cards, {out_of_order} out of order, ' +
+      f'{len(set(result) ^ set(deck))} cards differ from the deck')
@@ -0,0 +1,139 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+import cv2
+import numpy as np
+
+import common
+
+# Frames are compared at a quarter of the camera's resolution.
+SMALL_WIDTH = 320
+SMALL_HEIGHT = 180
+SCALE = SMALL_WIDTH / 1280
+# How many points along each edge of the card are checked.
+EDGE_SAMPLES = 16
+
+
+class FrameGate:
+    """
+    Decides which camera frames are worth recognizing in the live camera modes.
+
+    Most of the time, nothing in view changes from one frame to the next, so
+    there's no point running the corner and embedding models again. A frame is
+    recognized when it differs from the last recognized frame (by mean
+    grayscale difference of low-resolution copies) by more than
+    `max_difference`, but only once the view has stopped changing, so a card
+    is recognized once it's been put down rather than while it's moving.
+
+    When a frame is recognized, the previous corners are reused if the edges of
+    the card are still where they were, which saves running the corner model
+    when, e.g., the lighting changes. The edges are considered to still be
+    there if at least `edge_fraction` of the points along them have a gradient
+    stronger than `edge_threshold`.
+
+    The settings come from `camera_gate` in the config:
+
+    enabled: Whether to gate frames at all. If false, every frame is
+      recognized. Defaults to true.
+    max_difference: Defaults to 3.
+    edge_fraction: Defaults to 0.75.
+    edge_threshold: Defaults to 40.
+    """
+    def __init__(self, thumbnailer, config):
+        self.thumbnailer = thumbnailer
+        self.enabled = common.get_setting(config, 'camera_gate.enabled', True)
+        self.max_difference = common.get_setting(
+            config, 'camera_gate.max_difference', 3)
+        self.edge_fraction = common.get_setting(config,
+                                                'camera_gate.edge_fraction',
+                                                0.75)
+        self.edge_threshold = common.get_setting(config,
+                                                 'camera_gate.edge_threshold',
+                                                 40)
+        self.small = None
+        self.previous_small = None
+        self.reference = None
+        self.pending = True
+        self.corners = None
+
+        self.frames = 0
+        self.recognized_frames = 0
+        self.reused_corners = 0
+
+    def shrink(self, rgb_frame):
+        gray = cv2.cvtColor(rgb_frame, cv2.COLOR_RGB2GRAY)
+        self.small = cv2.resize(gray, (SMALL_WIDTH, SMALL_HEIGHT),
+                                dst=self.small,
+                                interpolation=cv2.INTER_AREA)
+        return self.small
+
+    def should_recognize(self, rgb_frame):
+        """
+        Returns whether the frame should be recognized. If it returns True, the
+        frame becomes the reference that later frames are compared with.
+        """
+        self.frames += 1
+        if not self.enabled:
+            self.recognized_frames += 1
+            return True
+        small = self.shrink(rgb_frame)
+        if (self.reference is not None and cv2.absdiff(
+                small, self.reference).mean() > self.max_difference):
+            self.pending = True
+        still = (self.previous_small is not None and cv2.absdiff(
+            small, self.previous_small).mean() <= self.max_difference)
+        recognize = self.pending and still
+        if recognize:
+            self.reference = small.copy()
+            self.pending = False
+            self.recognized_frames += 1
+        self.previous_small, self.small = small, self.previous_small
+        return recognize
+
+    def edges_still_fit(self, corners):
+        """Checks whether the card's edges are still at the given corners."""
+        gray = self.previous_small
+        magnitude = cv2.magnitude(cv2.Sobel(gray, cv2.CV_32F, 1, 0),
+                                  cv2.Sobel(gray, cv2.CV_32F, 0, 1))
+        # Allow the edge to be a pixel away from where we expect it.
+        magnitude = cv2.dilate(magnitude, np.ones((3, 3), np.uint8))
+        points = corners.astype(np.single) * SCALE
+        fractions = np.linspace(0, 1, EDGE_SAMPLES + 2)[1:-1, np.newaxis]
+        samples = np.concatenate([
+            points[i] + (points[(i + 1) % 4] - points[i]) * fractions
+            for i in range(4)
+        ])
+        x = np.clip(np.round(samples[:, 0]).astype(int), 0, SMALL_WIDTH - 1)
+        y = np.clip(np.round(samples[:, 1]).astype(int), 0, SMALL_HEIGHT - 1)
+        strong = magnitude[y, x] > self.edge_threshold
+        return np.mean(strong) >= self.edge_fraction
+
+    def find_corners(self, rgb_frame):
+        """
+        Returns the card's corners in the frame, reusing the last ones if they
+        still fit. Only call this for frames `should_recognize` accepted.
+        """
+        if (self.enabled and self.corners is not None
+                and self.edges_still_fit(self.corners)):
+            self.reused_corners += 1
+        else:
+            self.corners = self.thumbnailer.get_card_corners(rgb_frame)
+        return self.corners
+
+    def print(self):
+        print(f'Frame gate: recognized {self.recognized_frames} of ' +
+              f'{self.frames} frames, reused corners ' +
+              f'{self.reused_corners} times')
@@ -0,0 +1,100 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import time
+
+import numpy as np
+
+import common
+
+# Set to 'tflite_runtime' or 'tensorflow' to force a particular runtime.
+# Otherwise the lightweight tflite_runtime package is used if it's installed.
+BACKEND_VARIABLE = 'OPEN_SORTS_TFLITE_BACKEND'
+
+
+def load_runtime():
+    """
+    Returns the (Interpreter, OpResolverType) classes from tflite_runtime if
+    it's available, falling back to full TensorFlow. Running the models only
+    needs tflite_runtime, which starts much faster and uses far less memory
+    than importing TensorFlow.
+    """
+    backend = os.environ.get(BACKEND_VARIABLE)
+    if backend != 'tensorflow':
+        try:
+            from tflite_runtime import interpreter
+            return interpreter.Interpreter, interpreter.OpResolverType
+        except ImportError:
+            if backend == 'tflite_runtime':
+                raise
+    import tensorflow as tf
+    return tf.lite.Interpreter, tf.lite.experimental.OpResolverType
+
+
+def make_interpreter(config, name, model_path, batch_size=1):
+    """
+    Creates a TFLite interpreter for one of our models. The runtime settings
+    come from `interpreters.<name>` in the config:
+
+    num_threads: How many threads the interpreter may use. Defaults to letting
+      TFLite decide.
+    use_xnnpack: Whether to use the XNNPACK delegate, which is much faster on
+      ARM CPUs. Defaults to true.
+    warmup_invokes: How many invokes to run at startup, so that the first card
+      doesn't pay for the interpreter's one-off setup costs. Defaults to 2.
+    """
+    num_threads = common.get_setting(config, f'interpreters.{name}.num_threads')
+    use_xnnpack = common.get_setting(config, f'interpreters.{name}.use_xnnpack',
+                                     True)
+    warmup_invokes = common.get_setting(
+        config, f'interpreters.{name}.warmup_invokes', 2)
+
+    Interpreter, OpResolverType = load_runtime()
+    options = {'model_path': model_path, 'num_threads': num_threads}
+    if not use_xnnpack:
+        # XNNPACK is applied by default, so opting out means asking for the
+        # builtin ops without the default delegates.
+        options['experimental_op_resolver_type'] = (
+            OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES)
+    interpreter = Interpreter(**options)
+
+    if batch_size != 1:
+        input_details = interpreter.get_input_details()[0]
+        interpreter.resize_tensor_input(
+            input_details['index'], [batch_size, *input_details['shape'][1:]])
+    interpreter.allocate_tensors()
+
+    print(f'Created {name} interpreter ({Interpreter.__module__}): ' +
+          f'threads={num_threads or "default"}, ' +
+          f'xnnpack={use_xnnpack}, batch size={batch_size}')
+    if warmup_invokes > 0:
+        warm_up(interpreter, name, warmup_invokes)
+    return interpreter
+
+
+def warm_up(interpreter, name, invokes):
+    """Runs the interpreter on blank input and prints how long it took."""
+    input_details = interpreter.get_input_details()[0]
+    blank = np.zeros(input_details['shape'], dtype=input_details['dtype'])
+    timings = []
+    for _ in range(invokes):
+        interpreter.set_tensor(input_details['index'], blank)
+        start = time.perf_counter()
+        interpreter.invoke()
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f'Warm-up invoke times for {name}: ' +
+          ', '.join(f'{timing:.1f} ms' for timing in timings))
@@ -0,0 +1,278 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+import bisect
+import collections
+import http.server
+import json
+import threading
+import time
+
+import common
+
+# Histogram buckets, in the Prometheus style: each counts the observations less
+# than or equal to its upper bound.
+DISTANCE_BUCKETS = [0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5, 0.75, 1.0]
+COMMAND_BUCKETS = [0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10]
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One more count than buckets, for +Inf.
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def exposition(self, name, labels=''):
+        """Returns the Prometheus text format lines for the histogram."""
+        lines = []
+        cumulative = 0
+        separator = ',' if labels else ''
+        for bound, count in zip(self.buckets + ['+Inf'], self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} ' +
+                         f'{cumulative}')
+        braces = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{braces} {self.sum}')
+        lines.append(f'{name}_count{braces} {self.count}')
+        return lines
+
+
+class SessionMetrics:
+    """
+    Tracks the throughput of a sorting session: cards per minute, both over the
+    last `window` seconds and for the pass as a whole, how many passes are left
+    and when the session should finish, the distribution of recognition
+    distances, and how long each device command takes.
+
+    A slowly dropping card rate, creeping command latencies, or distances
+    drifting upwards are early signs of mechanical wear or changing lighting.
+
+    The metrics are served in the Prometheus text format from
+    http://localhost:<port>/metrics, and a record of every card and every pass
+    is appended to a JSONL file. The settings come from `metrics` in the config:
+
+    enabled: Whether to collect metrics at all. Defaults to false.
+    port: The port to serve the metrics on, or null to not serve them.
+      Defaults to 9108.
+    jsonl_path: The file to append records to, or null to not write them.
+      Defaults to sort_metrics.jsonl.
+    window: The number of seconds over which the current card rate is
+      measured. Defaults to 60.
+    """
+    def __init__(self, config):
+        self.port = common.get_setting(config, 'metrics.port', 9108)
+        self.jsonl_path = common.get_setting(config, 'metrics.jsonl_path',
+                                             'sort_metrics.jsonl')
+        self.window = common.get_setting(config, 'metrics.window', 60)
+        self.lock = threading.Lock()
+
+        self.cards_total = 0
+        self.pass_number = 0
+        self.pass_start = None
+        self.pass_cards = 0
+        # The number of cards in the stack, once the first pass has counted
+        # them.
+        self.stack_size = None
+        # Including the current pass, or None while it's unknown.
+        self.passes_remaining = None
+        self.recent_cards = collections.deque()
+        self.distances = Histogram(DISTANCE_BUCKETS)
+        self.commands = {}
+
+        self.jsonl_file = None
+        if self.jsonl_path is not None:
+            self.jsonl_file = open(self.jsonl_path, 'a', encoding='utf-8')
+        self.server = None
+        if self.port is not None:
+            self.start_server()
+
+    def start_server(self):
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ['/', '/metrics']:
+                    self.send_error(404)
+                    return
+                body = metrics.exposition().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Don't clutter the sorter's output with request logs.
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('localhost', self.port),
+                                                      Handler)
+        threading.Thread(target=self.server.serve_forever,
+                         name='metrics server',
+                         daemon=True).start()
+        print(f'Serving metrics on http://localhost:{self.port}/metrics')
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.jsonl_file is not None:
+            self.jsonl_file.close()
+
+    def write_record(self, record):
+        if self.jsonl_file is not None:
+            self.jsonl_file.write(json.dumps(record) + '\n')
+            self.jsonl_file.flush()
+
+    def start_pass(self, pass_number, passes_remaining=None):
+        with self.lock:
+            self.pass_number = pass_number
+            self.pass_start = time.time()
+            self.pass_cards = 0
+            self.passes_remaining = passes_remaining
+
+    def end_pass(self):
+        with self.lock:
+            if self.stack_size is None:
+                self.stack_size = self.pass_cards
+            record = {
+                'event': 'pass',
+                'time': time.time(),
+                'pass': self.pass_number,
+                'cards': self.pass_cards,
+                'seconds': time.time() - self.pass_start,
+                'cards_per_minute': self.pass_rate()
+            }
+            self.write_record(record)
+
+    def record_card(self, card_id, distance):
+        with self.lock:
+            now = time.time()
+            self.cards_total += 1
+            self.pass_cards += 1
+            self.recent_cards.append(now)
+            self.distances.observe(distance)
+            record = {
+                'event': 'card',
+                'time': now,
+                'pass': self.pass_number,
+                'card': self.pass_cards,
+                'card_id': card_id,
+                'distance': distance,
+                'cards_per_minute': self.current_rate(now),
+                'eta_seconds': self.eta(now)
+            }
+            self.write_record(record)
+
+    def record_command(self, command, seconds):
+        with self.lock:
+            histogram = self.commands.get(command)
+            if histogram is None:
+                histogram = self.commands[command] = Histogram(COMMAND_BUCKETS)
+            histogram.observe(seconds)
+
+    def current_rate(self, now):
+        """Cards per minute over the last `window` seconds."""
+        while self.recent_cards and self.recent_cards[0] < now - self.window:
+            self.recent_cards.popleft()
+        if len(self.recent_cards) < 2:
+            return 0
+        elapsed = now - self.recent_cards[0]
+        return (len(self.recent_cards) - 1) / elapsed * 60 if elapsed > 0 else 0
+
+    def pass_rate(self):
+        """Cards per minute over the current pass."""
+        if self.pass_start is None:
+            return 0
+        elapsed = time.time() - self.pass_start
+        return self.pass_cards / elapsed * 60 if elapsed > 0 else 0
+
+    def eta(self, now):
+        """
+        The estimated seconds until the sort is finished, not counting the time
+        spent reloading the hopper, or None if it can't be estimated yet.
+        """
+        if self.stack_size is None or self.passes_remaining is None:
+            return None
+        rate = self.pass_rate() or self.current_rate(now)
+        if rate == 0:
+            return None
+        cards_left = (max(0, self.stack_size - self.pass_cards) +
+                      max(0, self.passes_remaining - 1) * self.stack_size)
+        return cards_left / rate * 60
+
+    def exposition(self):
+        """Returns all the metrics in the Prometheus text format."""
+        with self.lock:
+            now = time.time()
+            eta = self.eta(now)
+            lines = [
+                '# HELP opensorts_cards_total Cards recognized this session.',
+                '# TYPE opensorts_cards_total counter',
+                f'opensorts_cards_total {self.cards_total}',
+                '# HELP opensorts_pass The current pass, starting at 1.',
+                '# TYPE opensorts_pass gauge',
+                f'opensorts_pass {self.pass_number}',
+                '# HELP opensorts_pass_cards Cards recognized this pass.',
+                '# TYPE opensorts_pass_cards gauge',
+                f'opensorts_pass_cards {self.pass_cards}',
+                '# HELP opensorts_cards_per_minute Cards per minute over ' +
+                f'the last {self.window} seconds.',
+                '# TYPE opensorts_cards_per_minute gauge',
+                f'opensorts_cards_per_minute {self.current_rate(now)}',
+                '# HELP opensorts_pass_cards_per_minute Cards per minute ' +
+                'over the current pass.',
+                '# TYPE opensorts_pass_cards_per_minute gauge',
+                f'opensorts_pass_cards_per_minute {self.pass_rate()}',
+            ]
+            if self.passes_remaining is not None:
+                lines += [
+                    '# HELP opensorts_passes_remaining Passes left, ' +
+                    'including the current one.',
+                    '# TYPE opensorts_passes_remaining gauge',
+                    f'opensorts_passes_remaining {self.passes_remaining}',
+                ]
+            if eta is not None:
+                lines += [
+                    '# HELP opensorts_eta_seconds Estimated seconds until ' +
+                    'the sort is finished, not counting reloads.',
+                    '# TYPE opensorts_eta_seconds gauge',
+                    f'opensorts_eta_seconds {eta}',
+                ]
+            lines += [
+                '# HELP opensorts_recognition_distance Embedding distance ' +
+                'of each recognized card.',
+                '# TYPE opensorts_recognition_distance histogram',
+            ]
+            lines += self.distances.exposition(
+                'opensorts_recognition_distance')
+            lines += [
+                '# HELP opensorts_command_seconds Round trip time of each ' +
+                'device command.',
+                '# TYPE opensorts_command_seconds histogram',
+            ]
+            for command, histogram in sorted(self.commands.items()):
+                lines += histogram.exposition('opensorts_command_seconds',
+                                              f'command="{command}"')
+        return '\n'.join(lines) + '\n'
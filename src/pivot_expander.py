@@ -14,7 +14,7 @@
 # You should have received a copy of the GNU General Public License along with
 # OpenSorts. If not, see <https://www.gnu.org/licenses/>.
 
-import card_comparison
+import sort_ranks
 
 
 class PivotExpander:
@@ -40,8 +40,8 @@ class PivotExpander:
     The keyword there is "whenever possible". You could have two different
     printings of the same card being consecutive pivots. In that case it would
     be wrong to expand one of them. So, we have to expand the pivots for each
-    pass, every time the pivots are halved, because new expansions may become
-    possible.
+    pass, every time the pivots are halved (or divided by the number of output
+    trays), because new expansions may become possible.
     """
     def __init__(self, cards_by_id):
         cards_by_key = {}
@@ -58,19 +58,17 @@ class PivotExpander:
             else:
                 cards_by_key[key].append(id)
 
-        comparer = card_comparison.CardComparer(cards_by_id)
+        ranks = sort_ranks.load_rank_table(cards_by_id)
         # For every key that has more than one card, the pivot expansion is
-        # the last card (by sorting) in the list.
+        # the last card (by sorting) in the list. Of cards that sort equally,
+        # the last one in the list is used.
         print('Computing pivot expansion map')
         self.expansion_map = {}
         for key, cards in cards_by_key.items():
-            first_card_with_key = sorted([
-                card_comparison.ComparableCard(comparer, card_id)
-                for card_id in cards
-            ])[-1].card_id()
             if len(cards) > 1:
+                last_card_with_key = max(reversed(cards), key=ranks.rank)
                 for card_id in cards:
-                    self.expansion_map[card_id] = first_card_with_key
+                    self.expansion_map[card_id] = last_card_with_key
 
     def expand_pivot(self, current, previous):
         # We can only expand the pivot if the current pivot is different
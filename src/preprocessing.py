@@ -0,0 +1,66 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+import cv2
+import numpy as np
+
+import prof_timer
+import transform
+
+
+def reuse_buffer(buffer, shape, dtype=np.uint8):
+    """Returns `buffer` if it has the right shape, otherwise a new one."""
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+        return np.empty(shape, dtype=dtype)
+    return buffer
+
+
+class FramePreprocessor:
+    """
+    Turns camera frames into upright card images for the recognizer.
+
+    Everything stays in uint8 numpy arrays, and every step writes into a buffer
+    that's allocated once and reused for every frame. That means the images
+    returned by `process` are overwritten by the next call, so callers that want
+    to keep them must copy them.
+    """
+    def __init__(self, thumbnailer):
+        self.thumbnailer = thumbnailer
+        self.rgb_frame = None
+        self.upright = None
+        self.card_image = None
+
+    def process(self, bgr_frame):
+        """
+        Returns (card image, corners) for a BGR camera frame. The RGB version of
+        the frame is kept in `rgb_frame`.
+        """
+        with prof_timer.PerfTimer('camera preprocess'):
+            self.rgb_frame = reuse_buffer(self.rgb_frame, bgr_frame.shape)
+            cv2.cvtColor(bgr_frame, cv2.COLOR_BGR2RGB, dst=self.rgb_frame)
+            # The camera is mounted so the images come in sideways. The
+            # thumbnailer crops the card out and turns it upright.
+            self.upright, corners = self.thumbnailer.upright_card(
+                self.rgb_frame, dst=self.upright)
+
+            # I'm not sure if brightness and contrast adjustment is needed.
+            # Further experiments are needed to determine if this helps
+            # recognition accuracy.
+            self.card_image = reuse_buffer(self.card_image,
+                                           self.upright.shape)
+            transform.automatic_brightness_and_contrast(self.upright,
+                                                        dst=self.card_image)
+        return self.card_image, corners
@@ -14,20 +14,215 @@
 # You should have received a copy of the GNU General Public License along with
 # OpenSorts. If not, see <https://www.gnu.org/licenses/>.
 
+import atexit
+import contextvars
+import json
+import math
+import os
+import threading
 import time
 
+import common
+
+# Set to 1 to turn on profiling, or to a file name to also export a trace of
+# every span to that file. Profiling can also be turned on in the config.
+PROFILE_VARIABLE = 'OPEN_SORTS_PROFILE'
+
+# Durations are counted in logarithmic buckets, BUCKETS_PER_DOUBLING per
+# doubling, starting at MIN_DURATION seconds. That keeps percentiles to within
+# a few percent, in constant memory, however long the session runs.
+MIN_DURATION = 1e-6
+BUCKETS_PER_DOUBLING = 16
+NUM_BUCKETS = BUCKETS_PER_DOUBLING * 32
+
+# The labels of the spans that enclose the current one. Being a context
+# variable, it follows the code across asyncio tasks, and into executor threads
+# if the work is started with `run_in_context`.
+_span_stack = contextvars.ContextVar('span_stack', default=())
+
+
+class Histogram:
+    """Counts durations, in seconds, so that percentiles can be estimated."""
+    def __init__(self):
+        self.buckets = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, duration):
+        if duration <= MIN_DURATION:
+            bucket = 0
+        else:
+            bucket = min(
+                NUM_BUCKETS - 1,
+                int(math.log2(duration / MIN_DURATION) * BUCKETS_PER_DOUBLING))
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def percentile(self, percent):
+        """Returns the duration below which `percent`% of the durations fall."""
+        if self.count == 0:
+            return 0
+        rank = percent / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                # The middle of the bucket, and no more than the longest.
+                return min(
+                    self.max, MIN_DURATION * 2**(
+                        (bucket + 0.5) / BUCKETS_PER_DOUBLING))
+        return self.max
+
+
+class Profiler:
+    """
+    Collects the spans timed by PerfTimer. Each span is counted in a histogram
+    under its full path, e.g. 'card/recognize/embedding', and can also be
+    kept as an event for a Chrome trace (chrome://tracing or
+    https://ui.perfetto.dev).
+    """
+    def __init__(self):
+        self.enabled = False
+        self.print_spans = False
+        self.trace_path = None
+        self.max_trace_events = 1000000
+        self.histograms = {}
+        self.events = []
+        self.thread_names = {}
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def record(self, path, start, end):
+        with self.lock:
+            histogram = self.histograms.get(path)
+            if histogram is None:
+                histogram = self.histograms[path] = Histogram()
+            histogram.add(end - start)
+            if (self.trace_path is not None
+                    and len(self.events) < self.max_trace_events):
+                thread = threading.current_thread()
+                self.thread_names[thread.ident] = thread.name
+                self.events.append((path, thread.ident, start, end))
+
+    def print_summary(self):
+        if not self.histograms:
+            return
+        print('=============== PROFILE =================')
+        print(f'{"span":<40} {"count":>7} {"mean ms":>8} {"p50 ms":>8} ' +
+              f'{"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+        for path in sorted(self.histograms, key=lambda p: p.split('/')):
+            histogram = self.histograms[path]
+            depth = path.count('/')
+            label = '  ' * depth + path.rsplit('/', 1)[-1]
+            print(f'{label:<40} {histogram.count:>7} ' +
+                  f'{histogram.total / histogram.count * 1000:>8.2f} ' +
+                  f'{histogram.percentile(50) * 1000:>8.2f} ' +
+                  f'{histogram.percentile(95) * 1000:>8.2f} ' +
+                  f'{histogram.percentile(99) * 1000:>8.2f} ' +
+                  f'{histogram.max * 1000:>8.2f}')
+
+    def export_trace(self, path=None):
+        """Writes the spans as Chrome trace-event JSON."""
+        path = path or self.trace_path
+        if path is None:
+            return
+        with self.lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+        thread_ids = {ident: i for i, ident in enumerate(thread_names)}
+        trace = [{
+            'name': 'thread_name',
+            'ph': 'M',
+            'pid': 0,
+            'tid': thread_ids[ident],
+            'args': {
+                'name': name
+            }
+        } for ident, name in thread_names.items()]
+        for span_path, ident, start, end in events:
+            trace.append({
+                'name': span_path.rsplit('/', 1)[-1],
+                'cat': span_path,
+                'ph': 'X',
+                'pid': 0,
+                'tid': thread_ids[ident],
+                'ts': (start - self.origin) * 1e6,
+                'dur': (end - start) * 1e6
+            })
+        with open(path, 'w', encoding='utf-8') as trace_file:
+            json.dump({'traceEvents': trace}, trace_file)
+        print(f'Wrote {len(events)} profile spans to {path}')
+
+    def finish(self):
+        self.print_summary()
+        self.export_trace()
+
+
+profiler = Profiler()
+
+
+def configure(config=None):
+    """
+    Turns profiling on if the OPEN_SORTS_PROFILE environment variable, or
+    `profiler.enabled` in the config, asks for it. The settings under
+    `profiler` in the config:
+
+    enabled: Whether to profile. Defaults to false.
+    print_spans: Print every span as it finishes. Defaults to false.
+    trace_path: Where to write a Chrome trace of every span at exit. Defaults
+      to not writing one.
+    """
+    environment = os.environ.get(PROFILE_VARIABLE, '')
+    enabled = common.get_setting(config, 'profiler.enabled', False)
+    trace_path = common.get_setting(config, 'profiler.trace_path')
+    if environment not in ['', '0']:
+        enabled = True
+        if environment != '1':
+            trace_path = environment
+    if not enabled or profiler.enabled:
+        return
+    profiler.enabled = True
+    profiler.print_spans = common.get_setting(config, 'profiler.print_spans',
+                                              False)
+    profiler.trace_path = trace_path
+    atexit.register(profiler.finish)
+
+
+def run_in_context(function, *args):
+    """
+    Returns a function that runs `function(*args)` inside the current span, for
+    handing work to an executor thread.
+    """
+    context = contextvars.copy_context()
+    return lambda: context.run(function, *args)
+
 
 class PerfTimer:
-    """Utility that can be used to print out performance profile information."""
+    """
+    Times the enclosed code as a span, when profiling is turned on. Spans
+    nest, and each one is recorded under the path of the spans enclosing it.
+    """
     def __init__(self, label):
         self.label = label
         self.start = 0
+        self.token = None
 
     def __enter__(self):
+        if not profiler.enabled:
+            return
+        self.path = '/'.join(_span_stack.get() + (self.label, ))
+        self.token = _span_stack.set(_span_stack.get() + (self.label, ))
         self.start = time.perf_counter()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.token is None:
+            return
         end = time.perf_counter()
-        PRINT_PERFORMANCE_TIMERS = False
-        if PRINT_PERFORMANCE_TIMERS:
-            print(f'Perf timer [{self.label}]: {end - self.start}')
+        _span_stack.reset(self.token)
+        self.token = None
+        profiler.record(self.path, self.start, end)
+        if profiler.print_spans:
+            print(f'Perf timer [{self.path}]: {end - self.start}')
@@ -0,0 +1,133 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+import os
+
+import cv2
+import numpy as np
+
+# The number of set bits in every possible byte value.
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint16)
+
+
+def perceptual_hashes(image, hash_size):
+    """
+    Computes the difference hash of the image, upright and rotated 180 degrees,
+    so that a card matches its cache entry whichever way up it was fed.
+
+    The image is shrunk to a (hash_size + 1) x hash_size grayscale thumbnail,
+    and each bit of the hash says whether a pixel is brighter than its left
+    neighbour. The hashes are packed into hash_size * hash_size / 8 bytes.
+    """
+    image = np.asarray(image)
+    if image.dtype != np.uint8:
+        image = (np.clip(image, 0, 1) * 255).astype(np.uint8)
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (hash_size + 1, hash_size),
+                       interpolation=cv2.INTER_AREA).astype(np.int16)
+    upright = small[:, 1:] > small[:, :-1]
+    inverted = small[::-1, -2::-1] > small[::-1, :0:-1]
+    return np.packbits(upright), np.packbits(inverted)
+
+
+class RecognitionCache:
+    """
+    Remembers recent recognition results, keyed on a perceptual hash of the
+    card's thumbnail. Every card is photographed once per pass, and many
+    collections contain multiple copies of the same printing, so a close hash
+    match usually tells us which card it is. Reprints with the same art hash
+    alike too, so the recognizer treats a hit as a candidate to verify (see
+    Recognizer.recognize), rather than the answer.
+
+    The cache holds at most `capacity` entries, and evicts the least recently
+    used entry when it's full. A lookup hits if an entry's hash is within
+    `max_hamming_distance` bits of the image's hash.
+    """
+    def __init__(self, capacity=4096, max_hamming_distance=12, hash_size=16):
+        self.capacity = capacity
+        self.max_hamming_distance = max_hamming_distance
+        self.hash_size = hash_size
+        self.hashes = np.zeros((capacity, hash_size * hash_size // 8),
+                               dtype=np.uint8)
+        self.card_ids = [None] * capacity
+        self.distances = np.zeros(capacity, dtype=np.single)
+        self.last_used = np.zeros(capacity, dtype=np.int64)
+        self.size = 0
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, image):
+        return perceptual_hashes(image, self.hash_size)
+
+    def get(self, key):
+        """Returns the cached (card_id, distance) for the key, or None."""
+        self.clock += 1
+        if self.size > 0:
+            hashes = self.hashes[:self.size]
+            hamming = np.minimum(
+                POPCOUNT[hashes ^ key[0]].sum(axis=1),
+                POPCOUNT[hashes ^ key[1]].sum(axis=1))
+            best = np.argmin(hamming)
+            if hamming[best] <= self.max_hamming_distance:
+                self.hits += 1
+                self.last_used[best] = self.clock
+                return self.card_ids[best], float(self.distances[best])
+        self.misses += 1
+        return None
+
+    def put(self, key, card_id, distance):
+        self.clock += 1
+        if self.size < self.capacity:
+            slot = self.size
+            self.size += 1
+        else:
+            slot = np.argmin(self.last_used)
+        self.hashes[slot] = key[0]
+        self.card_ids[slot] = card_id
+        self.distances[slot] = distance
+        self.last_used[slot] = self.clock
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0
+
+    def save(self, path):
+        np.savez(path,
+                 hash_size=self.hash_size,
+                 hashes=self.hashes[:self.size],
+                 card_ids=np.array(self.card_ids[:self.size], dtype=str),
+                 distances=self.distances[:self.size],
+                 last_used=self.last_used[:self.size])
+
+    def load(self, path):
+        """Loads the entries saved by a previous session, if there are any."""
+        if not os.path.exists(path):
+            return
+        with np.load(path) as data:
+            if int(data['hash_size']) != self.hash_size:
+                print(f'Ignoring {path}: it was saved with a different ' +
+                      'hash size.')
+                return
+            # Keep the most recently used entries if there are too many.
+            order = np.argsort(data['last_used'])[-self.capacity:]
+            self.size = len(order)
+            self.hashes[:self.size] = data['hashes'][order]
+            self.card_ids[:self.size] = [str(c) for c in data['card_ids'][order]]
+            self.distances[:self.size] = data['distances'][order]
+            self.last_used[:self.size] = np.arange(1, self.size + 1)
+            self.clock = self.size
+        print(f'Loaded {self.size} recognition cache entries from {path}')
@@ -14,70 +14,48 @@
 # You should have received a copy of the GNU General Public License along with
 # OpenSorts. If not, see <https://www.gnu.org/licenses/>.
 
-import json
-import pickle
-import platform
-import sys
-
-import tensorflow as tf
-import tensorflow.keras.applications as applications
-import tensorflow_addons as tfa
 import cv2
 
+import camera_capture
 import transform
 import card_recognizer
 import common
+import frame_gate
+import prof_timer
 
 config = common.load_config()
+prof_timer.configure(config)
 transform_vector = transform.keypoints_to_transform(640, 448,
                                                     *config.camera_keypoints)
 
 print('Loading catalog')
-json_file = open("card_catalog.json", "r", encoding="utf-8")
-catalog = json.load(json_file)
-card_lookup = dict()
-for card in catalog:
-    id = card['id']
-    face_index = card['face_index']
-    card_id = f'{id}_{face_index}'
-    card_lookup[card_id] = card
+catalog, card_lookup = common.load_catalog()
 
 print('Initializing recognizer.')
-recognizer = card_recognizer.Recognizer(catalog)
+recognizer = card_recognizer.Recognizer(catalog, config)
 
 print('Creating camera.')
-if platform.system() == 'Windows':
-    # On Windows, the DirectShow interface seems to be faster and
-    # more reliable
-    print('Using DirectShow')
-    vc = cv2.VideoCapture(config.camera_id, cv2.CAP_DSHOW)
-else:
-    vc = cv2.VideoCapture(config.camera_id)
-vc.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-vc.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-
-print('Opening camera.')
-if not vc.isOpened():
-    print('Failed to open camera.')
-    sys.exit()
+camera = camera_capture.CameraCapture(config)
+# The card's position comes from the calibrated keypoints, so the gate doesn't
+# need to find corners.
+gate = frame_gate.FrameGate(None, config)
 
 previous_card_id = ''
+timestamp = None
 while True:
-    rval, frame = vc.read()
-    if not rval:
+    captured = camera.latest(newer_than=timestamp)
+    if captured is None:
         print('Error code on frame capture.')
         break
+    timestamp, frame = captured
 
     frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    image = tfa.image.transform(frame,
-                                transform_vector,
-                                interpolation='bilinear',
-                                fill_value=255,
-                                output_shape=(448, 640))
-    image, _, _ = transform.automatic_brightness_and_contrast(
-        tf.image.convert_image_dtype(image, tf.uint8).numpy())
-    image = tf.image.convert_image_dtype(image, tf.float32)
-    image = tf.image.rot90(image, k=1)
+    # Only recognize the card when something in view has changed.
+    if not gate.should_recognize(frame):
+        continue
+    image = transform.warp_perspective(frame, transform_vector, 640, 448)
+    image, _, _ = transform.automatic_brightness_and_contrast(image)
+    image = cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
     card_id, distance = recognizer.recognize(image)
 
     if card_id != previous_card_id:
@@ -92,4 +70,6 @@ while True:
             print(f'{distance} : {card_name} [{set_code}] : {card_id}')
 
 print('Shutting down.')
-vc.release()
+gate.print()
+camera.print()
+camera.release()
@@ -0,0 +1,136 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+import cv2
+import numpy as np
+
+import common
+
+# Frames are compared at this resolution. It's plenty to see a card moving, and
+# makes the comparison nearly free.
+SMALL_WIDTH = 320
+SMALL_HEIGHT = 180
+# How long to wait when settle detection is disabled. It's the fixed delay the
+# sorter used before there was settle detection.
+FIXED_WAIT = 0.3
+
+
+class SettleDetector:
+    """
+    Watches the camera after a card is delivered, and picks the first frame in
+    which the card has stopped moving and is in focus.
+
+    The Arduino reports that a card has arrived as soon as the tray sensors are
+    triggered, but the card keeps sliding for a little while after that. How
+    long varies from card to card, so rather than always waiting long enough
+    for the slowest card, we compare successive low-resolution frames. The card
+    is considered settled once the mean difference between frames has stayed
+    below `max_difference` for `stable_frames` frames, and the frame is nearly
+    as sharp (by the variance of its Laplacian) as the sharpest frame seen
+    since the card arrived. Motion blur makes a moving card less sharp, so the
+    sharpness check catches cards that are moving slowly but steadily.
+
+    The settings come from `camera.settle` in the config:
+
+    enabled: Whether to detect settling at all. If false, we wait a fixed 0.3
+      seconds instead, which is how the sorter used to work. Defaults to true.
+    max_difference: The mean per-pixel grayscale difference (0-255) between
+      frames below which the card is considered still. Defaults to 2.
+    stable_frames: How many successive still frames are needed. Defaults to 2.
+    sharpness_ratio: How sharp a frame must be, relative to the sharpest frame
+      seen for this card. Defaults to 0.8.
+    max_wait: The longest to wait for the card to settle, in seconds. If it
+      hasn't settled by then, the latest frame is used anyway. Defaults to 0.5.
+    """
+    def __init__(self, camera, config):
+        self.camera = camera
+        self.enabled = common.get_setting(config, 'camera.settle.enabled', True)
+        self.max_difference = common.get_setting(
+            config, 'camera.settle.max_difference', 2)
+        self.stable_frames = common.get_setting(
+            config, 'camera.settle.stable_frames', 2)
+        self.sharpness_ratio = common.get_setting(
+            config, 'camera.settle.sharpness_ratio', 0.8)
+        self.max_wait = common.get_setting(config, 'camera.settle.max_wait',
+                                           0.5)
+        self.gray = None
+        self.small = None
+        self.previous_small = None
+
+        # The measured settle time of every card, in seconds, and how many
+        # cards hit max_wait without settling.
+        self.settle_times = []
+        self.timeouts = 0
+
+    def shrink(self, frame):
+        """Returns a low-resolution grayscale copy of the frame."""
+        self.gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        self.small = cv2.resize(self.gray, (SMALL_WIDTH, SMALL_HEIGHT),
+                                dst=self.small,
+                                interpolation=cv2.INTER_AREA)
+        return self.small
+
+    def wait_for_settled_frame(self, moment):
+        """
+        Returns (timestamp, frame) for the first frame after `moment` in which
+        the card has settled, or None if the camera fails. `moment` should be
+        when the card arrived, as a time.monotonic() timestamp.
+        """
+        if not self.enabled:
+            captured = self.camera.frame_after(moment + FIXED_WAIT)
+            if captured is not None:
+                self.settle_times.append(FIXED_WAIT)
+            return captured
+
+        deadline = moment + self.max_wait
+
+        peak_sharpness = 0
+        still_frames = 0
+        self.previous_small = None
+        timestamp = moment
+        while True:
+            captured = self.camera.frame_after(timestamp)
+            if captured is None:
+                return None
+            timestamp, frame = captured
+            if timestamp >= deadline:
+                self.timeouts += 1
+                self.settle_times.append(timestamp - moment)
+                return captured
+
+            small = self.shrink(frame)
+            sharpness = cv2.Laplacian(small, cv2.CV_32F).var()
+            peak_sharpness = max(peak_sharpness, sharpness)
+            if self.previous_small is not None:
+                difference = cv2.absdiff(small, self.previous_small).mean()
+                if difference <= self.max_difference:
+                    still_frames += 1
+                else:
+                    still_frames = 0
+            self.previous_small, self.small = small, self.previous_small
+
+            if (still_frames >= self.stable_frames
+                    and sharpness >= self.sharpness_ratio * peak_sharpness):
+                self.settle_times.append(timestamp - moment)
+                return captured
+
+    def print(self):
+        if not self.settle_times:
+            return
+        times = np.array(self.settle_times) * 1000
+        print(f'Settle time: {np.mean(times):.0f} ms mean, ' +
+              f'{np.percentile(times, 95):.0f} ms p95, ' +
+              f'{self.timeouts} of {len(times)} cards hit max_wait')
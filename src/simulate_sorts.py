@@ -0,0 +1,155 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+# Predicts how many passes, card movements and operator reloads sorting will
+# take, and roughly how long, by simulating whole sorting sessions (see
+# sort_simulator.py) over a sweep of stacks and machine setups. The
+# simulations run in parallel, one per process.
+#
+# The sweep is set by `simulator` in the config:
+#
+# stack_sizes: Sizes of the made up stacks to sort. Defaults to [1000, 10000].
+# tray_counts: Defaults to [2].
+# strategies: The values of `sort_strategy` to compare (see
+#   sort_cards.make_subsequent_pass_sorter). Defaults to ['pivots',
+#   'natural_merge'].
+# presorted: Fractions of each made up stack that's already in sorted order.
+#   Defaults to [0].
+# misread_rates: How often a card with reprints of the same artwork is
+#   recognized as one of them (see sort_simulator.simulate). Defaults to [0,
+#   0.2, 0.5].
+# seeds: How many different made up stacks of each kind to sort. Defaults to
+#   1.
+# recorded: Files with the order of real stacks (see
+#   sort_simulator.read_recorded_stack), sorted with the real catalog, in
+#   addition to the made up stacks. Defaults to none.
+# costs: Seconds for each operation. Defaults to
+#   sort_simulator.DEFAULT_COSTS.
+# processes: Defaults to the number of CPUs.
+
+import concurrent.futures
+import itertools
+import statistics
+
+import common
+import sort_ranks
+import sort_simulator
+import synthetic_cards
+
+_catalog = None
+
+
+def real_catalog():
+    global _catalog
+    if _catalog is None:
+        _catalog = common.load_catalog()[1]
+    return _catalog
+
+
+def simulate_synthetic(size, tray_count, strategy, presorted, misread_rate,
+                       seed, costs):
+    cards = synthetic_cards.make_cards(size, seed)
+    stack = synthetic_cards.make_stack(cards, size, seed)
+    if presorted:
+        stack = sort_simulator.presort(stack, cards, presorted, seed)
+    return sort_simulator.simulate(cards,
+                                   stack,
+                                   tray_count,
+                                   costs,
+                                   strategy=strategy,
+                                   misread_rate=misread_rate,
+                                   seed=seed)
+
+
+def simulate_recorded(path, tray_count, strategy, misread_rate, costs):
+    stack = sort_simulator.read_recorded_stack(path)
+    return sort_simulator.simulate(real_catalog(),
+                                   stack,
+                                   tray_count,
+                                   costs,
+                                   strategy=strategy,
+                                   misread_rate=misread_rate)
+
+
+def describe(seconds):
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02}:{seconds:02}'
+
+
+def print_row(name, tray_count, strategy, results):
+    """Prints the average over the results of one kind of stack."""
+    def mean(field):
+        return statistics.mean(getattr(result, field) for result in results)
+
+    print(f'{name:<36} {tray_count:>5} {strategy:<14} {mean("cards"):>7.0f} ' +
+          f'{mean("passes"):>6.1f} {mean("feeds") + mean("sends"):>9.0f} ' +
+          f'{mean("reloads"):>7.1f} {describe(mean("seconds")):>9} ' +
+          f'{mean("out_of_order"):>12.1f}')
+
+
+# The workers import this file, so only run the sweep in the main process.
+if __name__ == '__main__':
+    config = common.load_config()
+    stack_sizes = common.get_setting(config, 'simulator.stack_sizes',
+                                     [1000, 10000])
+    tray_counts = common.get_setting(config, 'simulator.tray_counts', [2])
+    strategies = common.get_setting(config, 'simulator.strategies',
+                                    ['pivots', 'natural_merge'])
+    presorted_fractions = common.get_setting(config, 'simulator.presorted',
+                                             [0])
+    misread_rates = common.get_setting(config, 'simulator.misread_rates',
+                                       [0, 0.2, 0.5])
+    seeds = common.get_setting(config, 'simulator.seeds', 1)
+    recorded = common.get_setting(config, 'simulator.recorded', [])
+    costs = common.get_setting(config, 'simulator.costs')
+    costs = common.to_dictionary(costs) if costs is not None else None
+    processes = common.get_setting(config, 'simulator.processes')
+    if recorded:
+        # Compute and cache the real catalog's ranks once, rather than in every
+        # worker at the same time.
+        print('Loading catalog')
+        sort_ranks.load_rank_table(real_catalog())
+
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        jobs = {}
+        for size, presorted, misread_rate, tray_count, strategy in (
+                itertools.product(stack_sizes, presorted_fractions,
+                                  misread_rates, tray_counts, strategies)):
+            name = f'made up, {presorted:.0%} presorted'
+            if misread_rate:
+                name += f', {misread_rate:.0%} misread'
+            jobs[(name, size, tray_count, strategy)] = [
+                executor.submit(simulate_synthetic, size, tray_count,
+                                strategy, presorted, misread_rate, seed,
+                                costs) for seed in range(seeds)
+            ]
+        for path, misread_rate, tray_count, strategy in itertools.product(
+                recorded, misread_rates, tray_counts, strategies):
+            name = path
+            if misread_rate:
+                name += f', {misread_rate:.0%} misread'
+            jobs[(name, None, tray_count, strategy)] = [
+                executor.submit(simulate_recorded, path, tray_count,
+                                strategy, misread_rate, costs)
+            ]
+
+        print(f'{"stack":<36} {"trays":>5} {"strategy":<14} {"cards":>7} ' +
+              f'{"passes":>6} {"movements":>9} {"reloads":>7} {"time":>9} ' +
+              f'{"out of order":>12}')
+        for (name, _, tray_count, strategy), futures in jobs.items():
+            print_row(name, tray_count, strategy,
+                      [future.result() for future in futures])
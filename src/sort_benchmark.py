@@ -0,0 +1,93 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+# Compares sorting with CardComparer against sorting with the precomputed rank
+# table (see sort_ranks.py), over the whole catalog and for the sorter's own
+# decisions on a random stack of cards.
+
+import contextlib
+import io
+import random
+import time
+
+import numpy as np
+
+import card_comparison
+import common
+import sort_cards
+import sort_ranks
+
+STACK_SIZE = 1000
+
+
+def timed(description, function):
+    start = time.perf_counter()
+    # The sorters print a lot, which would swamp the timings.
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function()
+    print(f'{description:<48} {time.perf_counter() - start:>8.3f}s')
+    return result
+
+
+print('Loading catalog')
+catalog, cards_by_id = common.load_catalog()
+card_ids = list(cards_by_id.keys())
+print(f'{len(card_ids)} cards')
+comparer = card_comparison.CardComparer(cards_by_id)
+
+by_comparer = timed(
+    'Sort the catalog with CardComparer', lambda: sorted(
+        card_ids,
+        key=lambda card_id: card_comparison.ComparableCard(comparer, card_id)))
+ranks = timed('Compute the rank table',
+              lambda: sort_ranks.compute_ranks(cards_by_id))
+table = timed('Load the rank table (cached after the first run)',
+              lambda: sort_ranks.load_rank_table(cards_by_id))
+by_rank = timed('Sort the catalog by rank',
+                lambda: sorted(card_ids, key=table.rank))
+order = timed('Sort the catalog by rank with numpy',
+              lambda: np.argsort(ranks, kind='stable'))
+print('Same order: ' +
+      str(by_comparer == by_rank and by_rank == [card_ids[i] for i in order]))
+
+rng = random.Random(0)
+stack = [rng.choice(card_ids) for _ in range(STACK_SIZE)]
+
+
+def first_pass():
+    sorter = sort_cards.FirstPassSorter(cards_by_id)
+    for card_id in stack:
+        sorter.decide_direction(card_id)
+    return sorter.get_results()
+
+
+hopper = timed(f'First pass over {STACK_SIZE} cards', first_pass)
+sorter = timed('Plan the subsequent passes',
+               lambda: sort_cards.SubsequentPassSorter(cards_by_id, hopper))
+
+
+def comparer_decisions():
+    # What find_pivot used to do, for comparison.
+    for card_id in hopper:
+        for pivot in sorter.pivots:
+            if not comparer.less(pivot, card_id):
+                break
+
+
+timed(f'Find pivots for {STACK_SIZE} cards with CardComparer',
+      comparer_decisions)
+timed(f'Find pivots for {STACK_SIZE} cards by rank',
+      lambda: [sorter.find_pivot(card_id) for card_id in hopper])
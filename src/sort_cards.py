@@ -14,12 +14,15 @@
 # You should have received a copy of the GNU General Public License along with
 # OpenSorts. If not, see <https://www.gnu.org/licenses/>.
 
+import bisect
 import math
 import random
 from collections import namedtuple
 
-import card_comparison
+import numpy as np
+
 import pivot_expander
+import sort_ranks
 
 
 def make_readable(card_lookup, values):
@@ -37,12 +40,83 @@ def make_readable(card_lookup, values):
         return f'{card["name"]} [{card["set"]}]'
 
 
-def flip_direction(direction):
-    """Returns the opposite of the direction provided."""
-    if direction == 'right':
-        return 'left'
-    else:
-        return 'right'
+# On the standard machine, the tray sends cards into one of two baskets. Tray 0
+# is the left basket and tray 1 is the right basket. Machines with more output
+# trays number them from 0, in the order they're stacked back into the hopper.
+TRAY_NAMES = ['left', 'right']
+
+# How far ahead in the hopper NaturalMergeSorter looks for a card that's out of
+# sequence.
+LOOKAHEAD = 8
+
+
+def tray_name(tray, tray_count=2):
+    """Returns a human readable name for the output tray."""
+    if tray_count == 2:
+        return TRAY_NAMES[tray]
+    return f'tray {tray}'
+
+
+def next_tray(tray, tray_count=2):
+    """
+    Returns the tray after this one, wrapping around. With two trays, that's
+    the other one.
+    """
+    return (tray + 1) % tray_count
+
+
+class SortedPivots:
+    """
+    The first pass's pivots, in sort order, each with the direction it sends
+    cards. The pivots are kept in short blocks, the way the sortedcontainers
+    package does it, so inserting a pivot only moves the pivots in its block
+    rather than every pivot after it. With tens of thousands of pivots, that
+    keeps the time per card flat.
+    """
+    BLOCK_SIZE = 256
+
+    def __init__(self, rank, card_id, direction):
+        # The ranks of the pivots in each block, and the (card id, direction)
+        # of each pivot.
+        self.rank_blocks = [[rank]]
+        self.pivot_blocks = [[(card_id, direction)]]
+        # The last rank in each block.
+        self.block_maxes = [rank]
+
+    def find(self, rank):
+        """
+        Returns the location of the first pivot that isn't less than the rank,
+        as (block, index). There must be one.
+        """
+        block = bisect.bisect_left(self.block_maxes, rank)
+        return block, bisect.bisect_left(self.rank_blocks[block], rank)
+
+    def get(self, location):
+        block, index = location
+        return self.pivot_blocks[block][index]
+
+    def insert(self, location, rank, card_id, direction):
+        """Inserts a pivot before the one at the location."""
+        block, index = location
+        ranks = self.rank_blocks[block]
+        pivots = self.pivot_blocks[block]
+        ranks.insert(index, rank)
+        pivots.insert(index, (card_id, direction))
+        if len(ranks) > 2 * self.BLOCK_SIZE:
+            self.rank_blocks[block:block + 1] = [
+                ranks[:self.BLOCK_SIZE], ranks[self.BLOCK_SIZE:]
+            ]
+            self.pivot_blocks[block:block + 1] = [
+                pivots[:self.BLOCK_SIZE], pivots[self.BLOCK_SIZE:]
+            ]
+            self.block_maxes.insert(block, ranks[self.BLOCK_SIZE - 1])
+
+    def __len__(self):
+        return sum(len(pivots) for pivots in self.pivot_blocks)
+
+    def __iter__(self):
+        for pivots in self.pivot_blocks:
+            yield from pivots
 
 
 class FirstPassSorter:
@@ -54,46 +128,51 @@ class FirstPassSorter:
 
     It starts by sending all cards to the right basket. When the first out-of-
     order card comes along, it send it to the left basket, and inserts pivots so
-    as to ensure that pivot-sorting is maintained.
+    as to ensure that pivot-sorting is maintained. With more than two trays,
+    each new pivot sends cards to the tray after the one the next pivot sends
+    them to.
     """
-    def __init__(self, card_lookup):
+    def __init__(self, card_lookup, tray_count=2):
         self.card_lookup = card_lookup
+        self.tray_count = tray_count
+        self.ranks = sort_ranks.load_rank_table(card_lookup)
         # Start with a single, all-inclusive pivot.
-        self.pivots = [('UNKNOWN', 'left')]
-        self.left_basket = []
-        self.right_basket = []
-        self.comparer = card_comparison.CardComparer(card_lookup)
+        self.pivots = SortedPivots(self.ranks.rank('UNKNOWN'), 'UNKNOWN', 0)
+        self.baskets = [[] for _ in range(tray_count)]
 
     def decide_direction(self, card_id):
-        # Find the first pivot that is not less than the card.
-        for i in range(len(self.pivots)):
-            if not self.comparer.less(self.pivots[i][0], card_id):
-                break
+        # Find the first pivot that is not less than the card. The last pivot
+        # is greater than every card, so there always is one.
+        rank = self.ranks.rank(card_id)
+        location = self.pivots.find(rank)
+        pivot, pivot_tray = self.pivots.get(location)
         # If the card is already a pivot, do what the pivot says.
-        # Otherwise, insert a new pivot for this card, in the opposite direction
-        # as the pivot we found.
-        if self.pivots[i][0] == card_id:
-            d = self.pivots[i][1]
+        # Otherwise, insert a new pivot for this card, sending it to a
+        # different tray than the pivot we found.
+        if pivot == card_id:
+            tray = pivot_tray
         else:
-            d = flip_direction(self.pivots[i][1])
-            self.pivots.insert(i, (card_id, d))
+            tray = next_tray(pivot_tray, self.tray_count)
+            self.pivots.insert(location, rank, card_id, tray)
         # Keep track of the cards as they go by and which basket they're in.
-        if d == 'left':
-            self.left_basket.append(card_id)
-        else:
-            self.right_basket.append(card_id)
-        return d
+        self.baskets[tray].append(card_id)
+        return tray
 
     def get_results(self):
-        return self.left_basket + self.right_basket
+        return [card_id for basket in self.baskets for card_id in basket]
+
+    def predict_next(self):
+        # We have no idea what's in the hopper on the first pass.
+        return None
 
 
 class SubsequentPassSorter:
     """
     After the first pass, we have full knowledge of the cards, so we can do an
-    optimal Log2(N) pass sort algorithm. The algorithm we use is basically a
-    QuickSort, but we start at the leaves and work backwards to the trunk
-    (where QuickSort does the most coarse pivot first, we do it last).
+    optimal Log2(N) pass sort algorithm (Logk(N) with k output trays). The
+    algorithm we use is basically a QuickSort, but we start at the leaves and
+    work backwards to the trunk (where QuickSort does the most coarse pivot
+    first, we do it last).
 
     We can do even better than that if we can recognize subgroups of cards that
     will be contiguous in the final sort order and are already in the correct
@@ -101,11 +180,21 @@ class SubsequentPassSorter:
     a single unit, with a single pivot, cutting down on the total number of
     pivots
     """
-    def __init__(self, card_lookup, hopper):
+    def __init__(self, card_lookup, hopper, tray_count=2):
         self.card_lookup = card_lookup
-        self.comparer = card_comparison.CardComparer(card_lookup)
+        self.tray_count = tray_count
+        self.ranks = sort_ranks.load_rank_table(card_lookup)
         self.pivot_expander = pivot_expander.PivotExpander(card_lookup)
-        self.pivots = self.compute_pivots(hopper)
+        self.set_pivots(self.compute_pivots(hopper))
+        # The order of the cards in each pass is fully determined by the order
+        # in the previous pass and the directions they were sent, so we can
+        # predict which card is coming next.
+        self.hopper = list(hopper)
+        self.position = 0
+        self.baskets = [[] for _ in range(tray_count)]
+        # (expected, recognized) pairs for cards that didn't match the
+        # prediction in the current pass.
+        self.out_of_sequence = []
 
     def print_pivots(self):
         print('====== Pivots ======')
@@ -113,14 +202,20 @@ class SubsequentPassSorter:
             print(make_readable(self.card_lookup, v))
         print('====================')
 
+    def set_pivots(self, pivots):
+        self.pivots = pivots
+        # Pivot expansion can occasionally move a pivot past the one after it,
+        # so the pivots' ranks aren't always in order. The first pivot that's
+        # greater than or equal to a card is also the first place where the
+        # running maximum of the ranks is, and that is in order, so it can be
+        # binary searched.
+        self.pivot_ranks = np.maximum.accumulate(self.ranks.ranks(pivots))
+
     def find_pivot(self, current):
         """Finds the first pivot greater than or equal to the current card."""
-        # This could theoretically be sped up with a binary search, but honestly
-        # it's so fast already that it's no problem.
-        for i in range(len(self.pivots)):
-            if not self.comparer.less(self.pivots[i], current):
-                return i
-        return len(self.pivots)
+        return int(
+            np.searchsorted(self.pivot_ranks, self.ranks.rank(current),
+                            side='left'))
 
     def compute_pivots(self, hopper):
         """
@@ -138,9 +233,8 @@ class SubsequentPassSorter:
                 card_ranges[value] = Range(i, i)
         # Sort the unique cards by the position they should be in when we're
         # done sorting.
-        card_ranges = sorted(
-            card_ranges.items(),
-            key=lambda t: card_comparison.ComparableCard(self.comparer, t[0]))
+        card_ranges = sorted(card_ranges.items(),
+                             key=lambda t: self.ranks.rank(t[0]))
         print('Target output sequence:')
         for c, _ in card_ranges:
             d = self.card_lookup[c]
@@ -155,25 +249,263 @@ class SubsequentPassSorter:
         # Always add the last card as a pivot
         pivots.append(card_ranges[-1][0])
 
-        # Insert dummy pivots at the beginning until we have a power of 2
-        # number of pivots.
-        while len(pivots) not in (1, 2, 4, 8, 16, 32, 64, 128, 256, 512):
-            pivots.insert(0, -1)
+        # Insert dummy pivots at the beginning until the number of pivots is
+        # a power of the number of trays.
+        padded_length = 1
+        while padded_length < len(pivots):
+            padded_length *= self.tray_count
+        pivots = [-1] * (padded_length - len(pivots)) + pivots
         return self.pivot_expander.expand_pivots(pivots)
 
+    def predict_next(self):
+        """The card id we expect to be fed next, or None if we don't know."""
+        if self.position < len(self.hopper):
+            return self.hopper[self.position]
+        return None
+
     def decide_direction(self, card_id):
-        # If it's an even-numbered pivot, send it left, otherwise right.
-        i = self.find_pivot(card_id)
-        if i % 2 == 0:
-            d = 'left'
-        else:
-            d = 'right'
-        return d
+        expected = self.predict_next()
+        if expected is not None and expected != card_id:
+            print('Out of sequence: expected ' +
+                  f'{make_readable(self.card_lookup, expected)}, recognized ' +
+                  f'{make_readable(self.card_lookup, card_id)}')
+            self.out_of_sequence.append((expected, card_id))
+        self.position += 1
+
+        # With two trays, even-numbered pivots go left, and odd-numbered ones
+        # go right. With k trays, pivot i goes to tray i % k.
+        tray = self.find_pivot(card_id) % self.tray_count
+        self.baskets[tray].append(card_id)
+        return tray
 
     def reload_hopper(self):
-        # Whenever we reload the hopper, remove every second pivot.
-        self.pivots = self.pivot_expander.expand_pivots(self.pivots[1::2])
+        # Whenever we reload the hopper, keep only the last of every k pivots
+        # (every second pivot with two trays).
+        k = self.tray_count
+        self.set_pivots(
+            self.pivot_expander.expand_pivots(self.pivots[k - 1::k]))
+        if self.out_of_sequence:
+            print(f'{len(self.out_of_sequence)} cards were out of sequence ' +
+                  'on the last pass.')
+        # The baskets are stacked back into the hopper for the next pass.
+        self.hopper = [
+            card_id for basket in self.baskets for card_id in basket
+        ]
+        self.position = 0
+        self.baskets = [[] for _ in range(self.tray_count)]
+        self.out_of_sequence = []
 
     def is_sorted(self):
         # The cards are sorted when there's no more pivots left.
         return len(self.pivots) <= 1
+
+    def passes_remaining(self):
+        """
+        How many more passes are needed, including one that's in progress.
+        Every pass divides the number of pivots by the number of trays.
+        """
+        passes = 0
+        pivot_count = len(self.pivots)
+        while pivot_count > 1:
+            pivot_count = math.ceil(pivot_count / self.tray_count)
+            passes += 1
+        return passes
+
+
+class NaturalMergeSorter:
+    """
+    An alternative to SubsequentPassSorter that plans the passes from the runs
+    in the hopper after the first pass, and routes each card by its position
+    in the hopper rather than by comparing it with pivots.
+
+    A run is a group of cards that are already in the right order relative to
+    each other, and that make up a contiguous part of the final order. The
+    runs, one after the other, are the sorted stack. Every card is labelled
+    with the number of its run, and each pass sends the cards by one digit of
+    their label (in base k, with k trays), least significant digit first, like
+    a radix sort. Stacking the baskets back into the hopper can at best
+    combine k runs into one, so the ceil(logk(runs)) passes this takes is the
+    fewest possible for the hopper.
+
+    Runs are the same thing as the pivots in SubsequentPassSorter, except that
+    copies of a card (and different cards that sort equally) can be split
+    between the end of one run and the start of the next. Pivots can't do
+    that, because every copy of a card goes the same way as the pivot, so with
+    a lot of copies there can be fewer runs than pivots.
+
+    Because each card is routed by its position, a misrecognized card still
+    goes where it should, as long as it's where we expected it. If a card
+    turns up a little further on than we expected, e.g. because two cards were
+    fed at once, we catch up with it. The exception is a card with the same
+    name and artwork as the one we expected, which the recognizer often
+    confuses it with (see pivot_expander.py). Copies and reprints end up next
+    to each other in later passes, so that's most likely a misread, and we
+    only catch up if the next card confirms it, without looking like a misread
+    itself. Misreads on the first pass can't be caught, because the runs are
+    planned from what was recognized.
+    """
+    def __init__(self, card_lookup, hopper, tray_count=2):
+        self.card_lookup = card_lookup
+        self.tray_count = tray_count
+        self.ranks = sort_ranks.load_rank_table(card_lookup)
+        self.hopper = list(hopper)
+        self.labels, self.run_count = self.compute_runs(self.hopper)
+        self.passes = 0
+        while self.tray_count**self.passes < self.run_count:
+            self.passes += 1
+        self.pass_number = 0
+        self.position = 0
+        # Where we'd have caught up to if the last card hadn't looked like a
+        # misread.
+        self.possible_skip = None
+        self.baskets = [[] for _ in range(tray_count)]
+        # (expected, recognized) pairs for cards that didn't match the
+        # prediction in the current pass.
+        self.out_of_sequence = []
+
+    def compute_runs(self, hopper):
+        """
+        Splits the hopper into as few runs as possible. Returns the run number
+        of every card in the hopper, and the number of runs.
+        """
+        positions_by_rank = {}
+        for position, card_id in enumerate(hopper):
+            positions_by_rank.setdefault(self.ranks.rank(card_id),
+                                         []).append(position)
+        labels = [0] * len(hopper)
+        run = 0
+        run_end = -1
+        # Go through the cards in the final order, extending the current run
+        # for as long as the cards come after its end in the hopper.
+        for rank in sorted(positions_by_rank.keys()):
+            positions = positions_by_rank[rank]
+            split = bisect.bisect_left(positions, run_end)
+            if split > 0:
+                # Some copies come before the end of the current run. The ones
+                # after it finish the run, and the rest start the next one.
+                for position in positions[split:]:
+                    labels[position] = run
+                run += 1
+                positions = positions[:split]
+            for position in positions:
+                labels[position] = run
+            run_end = positions[-1]
+        return labels, run + 1 if hopper else 0
+
+    def print_pivots(self):
+        # The last card of each run plays the part of a pivot.
+        print(f'====== {self.run_count} runs ======')
+        last_cards = {}
+        for card_id, label in zip(self.hopper, self.labels):
+            last_cards[label] = card_id
+        for label in sorted(last_cards.keys()):
+            print(make_readable(self.card_lookup, last_cards[label]))
+        print('====================')
+
+    def predict_next(self):
+        """The card id we expect to be fed next, or None if we don't know."""
+        if self.position < len(self.hopper):
+            return self.hopper[self.position]
+        return None
+
+    def artwork_key(self, card_id):
+        if card_id not in self.card_lookup:
+            return None
+        card = self.card_lookup[card_id]
+        return (card['name'], card['illustration_id'], card['full_art'])
+
+    def catch_up(self, expected, card_id):
+        """
+        Moves on to where the out of sequence card is in the hopper, if it's
+        there and doesn't look like a misread of the card we expected.
+        """
+        possible_skip = self.possible_skip
+        self.possible_skip = None
+        could_be_misread = (self.artwork_key(expected) is not None
+                            and self.artwork_key(expected)
+                            == self.artwork_key(card_id))
+        # The last card looked like a misread, but this one is the card after
+        # the one it looked like, so cards really were skipped. In a group of
+        # reprints, this card could be a misread too, which confirms nothing.
+        if (possible_skip is not None and possible_skip + 1 < len(self.hopper)
+                and self.hopper[possible_skip + 1] == card_id
+                and not could_be_misread):
+            self.position = possible_skip + 1
+            return
+        ahead = self.hopper[self.position + 1:self.position + LOOKAHEAD]
+        if card_id not in ahead:
+            return
+        skip_to = self.position + 1 + ahead.index(card_id)
+        if could_be_misread:
+            self.possible_skip = skip_to
+        else:
+            self.position = skip_to
+
+    def decide_direction(self, card_id):
+        expected = self.predict_next()
+        if expected is not None and expected != card_id:
+            print('Out of sequence: expected ' +
+                  f'{make_readable(self.card_lookup, expected)}, recognized ' +
+                  f'{make_readable(self.card_lookup, card_id)}')
+            self.out_of_sequence.append((expected, card_id))
+            self.catch_up(expected, card_id)
+        else:
+            self.possible_skip = None
+        # Any extra cards go to the end.
+        label = self.labels[min(self.position, len(self.labels) - 1)]
+        self.position += 1
+
+        tray = label // self.tray_count**self.pass_number % self.tray_count
+        self.baskets[tray].append((card_id, label))
+        return tray
+
+    def reload_hopper(self):
+        if self.out_of_sequence:
+            print(f'{len(self.out_of_sequence)} cards were out of sequence ' +
+                  'on the last pass.')
+        # The baskets are stacked back into the hopper for the next pass.
+        self.hopper = [
+            card_id for basket in self.baskets for card_id, _ in basket
+        ]
+        self.labels = [
+            label for basket in self.baskets for _, label in basket
+        ]
+        self.pass_number += 1
+        self.position = 0
+        self.possible_skip = None
+        self.baskets = [[] for _ in range(self.tray_count)]
+        self.out_of_sequence = []
+
+    def is_sorted(self):
+        return self.pass_number >= self.passes
+
+    def passes_remaining(self):
+        """
+        How many more passes are needed, including one that's in progress.
+        """
+        return self.passes - self.pass_number
+
+
+def make_subsequent_pass_sorter(card_lookup,
+                                hopper,
+                                tray_count=2,
+                                strategy='pivots'):
+    """
+    Returns the sorter for the passes after the first one. 'pivots' is
+    SubsequentPassSorter, 'natural_merge' is NaturalMergeSorter, and
+    'fewest_passes' picks whichever of the two needs fewer passes for the
+    hopper, preferring SubsequentPassSorter (which expands pivots) on a tie.
+    """
+    if strategy == 'pivots':
+        return SubsequentPassSorter(card_lookup, hopper, tray_count)
+    if strategy == 'natural_merge':
+        return NaturalMergeSorter(card_lookup, hopper, tray_count)
+    if strategy == 'fewest_passes':
+        pivot_sorter = SubsequentPassSorter(card_lookup, hopper, tray_count)
+        merge_sorter = NaturalMergeSorter(card_lookup, hopper, tray_count)
+        print(f'Passes needed: {pivot_sorter.passes_remaining()} with ' +
+              f'pivots, {merge_sorter.passes_remaining()} with natural merge')
+        if merge_sorter.passes_remaining() < pivot_sorter.passes_remaining():
+            return merge_sorter
+        return pivot_sorter
+    raise ValueError(f'Unknown sort strategy: {strategy}')
@@ -0,0 +1,144 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+import functools
+import json
+import os
+
+import numpy as np
+
+import card_comparison
+import catalog_cache
+
+CACHE_PATH = 'sort_ranks.cache.npz'
+CACHE_FORMAT_VERSION = 1
+
+# The ranks of the placeholder pivots. -1 (the beginning) comes before every
+# card, and 'UNKNOWN' comes after every card, just like in CardComparer.
+BEGINNING_RANK = -1
+UNKNOWN_RANK = np.iinfo(np.int32).max
+
+_loaded = None
+
+
+class RankTable:
+    """
+    The position of every card in the catalog in the final sort order, as
+    defined by CardComparer. Cards that CardComparer considers equal have the
+    same rank, so comparing ranks gives exactly the same answers as
+    CardComparer.less, but with a single integer comparison.
+    """
+    def __init__(self, card_ids, ranks):
+        self.ranks_by_id = dict(zip(card_ids, ranks.tolist()))
+
+    def rank(self, card_id):
+        if card_id == -1:
+            return BEGINNING_RANK
+        if card_id == 'UNKNOWN':
+            return UNKNOWN_RANK
+        return self.ranks_by_id[card_id]
+
+    def ranks(self, card_ids):
+        """Returns the ranks of the cards as a numpy array."""
+        return np.array([self.rank(card_id) for card_id in card_ids],
+                        dtype=np.int64)
+
+    def less(self, left, right):
+        return self.rank(left) < self.rank(right)
+
+
+def compute_ranks(cards_by_id):
+    """
+    Sorts the whole catalog with CardComparer, and returns the rank of each
+    card, in the order of cards_by_id.keys().
+    """
+    comparer = card_comparison.CardComparer(cards_by_id)
+
+    def compare(left, right):
+        if comparer.less(left, right):
+            return -1
+        if comparer.less(right, left):
+            return 1
+        return 0
+
+    card_ids = list(cards_by_id.keys())
+    order = sorted(range(len(card_ids)),
+                   key=functools.cmp_to_key(
+                       lambda a, b: compare(card_ids[a], card_ids[b])))
+    ranks = np.empty(len(card_ids), dtype=np.int32)
+    rank = 0
+    for i, row in enumerate(order):
+        if i > 0 and compare(card_ids[order[i - 1]], card_ids[row]) != 0:
+            rank += 1
+        ranks[row] = rank
+    return ranks
+
+
+def sort_definition_digest():
+    """
+    Identifies the sort order. Any change to card_comparison.py, e.g. turning
+    on SIMPLY_ALPHABETIZE, invalidates the cached ranks.
+    """
+    return catalog_cache.file_digest(card_comparison.__file__)
+
+
+def read_cache(path, catalog_digest, sort_digest):
+    """Returns the cached ranks, or None if they're missing or stale."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        metadata = json.loads(str(data['metadata']))
+        if metadata != {
+                'format_version': CACHE_FORMAT_VERSION,
+                'catalog_sha1': catalog_digest,
+                'sort_sha1': sort_digest
+        }:
+            return None
+        return data['ranks']
+
+
+def load_rank_table(cards_by_id, cache_path=CACHE_PATH):
+    """
+    Returns the RankTable for the catalog. Sorting the whole catalog with
+    CardComparer takes a while, so the ranks are cached on disk for each
+    version of the catalog and of the sort order. Catalogs without a digest,
+    e.g. a dictionary of made up cards, aren't cached.
+    """
+    global _loaded
+    if _loaded is not None and _loaded[0] is cards_by_id:
+        return _loaded[1]
+    catalog_digest = getattr(cards_by_id, 'digest', None)
+    ranks = None
+    if catalog_digest is not None:
+        sort_digest = sort_definition_digest()
+        ranks = read_cache(cache_path, catalog_digest, sort_digest)
+        if ranks is not None and len(ranks) != len(cards_by_id):
+            ranks = None
+    if ranks is None:
+        if catalog_digest is not None:
+            print('Computing the sort rank of every card. This only ' +
+                  'happens when the catalog or the sort order changes.')
+        ranks = compute_ranks(cards_by_id)
+        if catalog_digest is not None:
+            metadata = {
+                'format_version': CACHE_FORMAT_VERSION,
+                'catalog_sha1': catalog_digest,
+                'sort_sha1': sort_digest
+            }
+            np.savez(cache_path, metadata=json.dumps(metadata), ranks=ranks)
+    table = RankTable(cards_by_id.keys(), ranks)
+    _loaded = (cards_by_id, table)
+    return table
@@ -0,0 +1,76 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+# Runs the sorting algorithm on stacks of made up cards, from 1,000 to 100,000
+# cards, without any hardware, and reports how long the sorter takes to decide
+# where each card goes. The time per card should stay roughly flat as the stack
+# grows.
+#
+# It also reports how many neighbouring cards are out of order at the end.
+# That's not zero, because pivot expansion (see pivot_expander.py) knowingly
+# lets a few reprints of the same card land slightly out of place.
+
+import contextlib
+import io
+import time
+
+import sort_cards
+import sort_ranks
+import synthetic_cards
+
+SIZES = [1000, 3000, 10000, 30000, 100000]
+
+
+def decide_all(sorter, stack):
+    """Returns the average seconds per decision."""
+    start = time.perf_counter()
+    for card_id in stack:
+        sorter.decide_direction(card_id)
+    return (time.perf_counter() - start) / len(stack)
+
+
+print(f'{"cards":>7} {"ranks s":>8} {"first us":>9} {"plan s":>7} ' +
+      f'{"pivots":>7} {"passes":>6} {"later us":>9} {"out of order":>12}')
+for size in SIZES:
+    cards = synthetic_cards.make_cards(size)
+    stack = synthetic_cards.make_stack(cards, size)
+    # The sorters print every pivot and every card in the target order.
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        ranks = sort_ranks.load_rank_table(cards)
+        ranks_seconds = time.perf_counter() - start
+
+        first_pass = sort_cards.FirstPassSorter(cards)
+        first_seconds = decide_all(first_pass, stack)
+        hopper = first_pass.get_results()
+
+        start = time.perf_counter()
+        sorter = sort_cards.SubsequentPassSorter(cards, hopper)
+        plan_seconds = time.perf_counter() - start
+        pivot_count = len(sorter.pivots)
+
+        passes = 0
+        later_seconds = 0
+        while not sorter.is_sorted():
+            later_seconds += decide_all(sorter, sorter.hopper)
+            sorter.reload_hopper()
+            passes += 1
+    final_ranks = [ranks.rank(card_id) for card_id in sorter.hopper]
+    out_of_order = sum(
+        first > second for first, second in zip(final_ranks, final_ranks[1:]))
+    print(f'{size:>7} {ranks_seconds:>8.2f} {first_seconds * 1e6:>9.1f} ' +
+          f'{plan_seconds:>7.2f} {pivot_count:>7} {passes:>6} ' +
+          f'{later_seconds / max(1, passes) * 1e6:>9.1f} {out_of_order:>12}')
@@ -0,0 +1,94 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+
+import common
+import prof_timer
+import sort_cards
+
+
+async def sort_cards_from_hopper(device, sorter, cards_by_id, metrics=None):
+    card_count = 0
+    card_in_tray = await device.feed_next()
+    while card_in_tray:
+        with prof_timer.PerfTimer('card'):
+            card_id = await device.identify(sorter.predict_next())
+            tray = sorter.decide_direction(card_id)
+            card_count = card_count + 1
+            if metrics is not None:
+                metrics.record_card(card_id, float(device.last_distance))
+            # Routing this card and feeding the next one happen together, so
+            # there's as little dead time between cards as possible. The
+            # device is already moving while we log.
+            next_card = asyncio.create_task(device.send_and_feed_next(tray))
+            print(f'Recognized: {cards_by_id[card_id]["name"]} ' +
+                  f'[{cards_by_id[card_id]["set"]}] -> ' +
+                  sort_cards.tray_name(tray, sorter.tray_count))
+            card_in_tray = await next_card
+    return card_count
+
+
+async def sort(device,
+               cards_by_id,
+               config,
+               on_pass_complete=None,
+               metrics=None):
+    """
+    Runs a whole sorting session on an async_device.AsyncSorter (or anything
+    with the same interface). If given, `on_pass_complete(pass_number,
+    card_count)` is called at the end of every pass, and progress is recorded
+    in `metrics` (a metrics.SessionMetrics).
+    """
+    tray_count = common.get_setting(config, 'tray_count', 2)
+    sorter = sort_cards.FirstPassSorter(cards_by_id, tray_count)
+    if metrics is not None:
+        metrics.start_pass(1)
+    card_count = await sort_cards_from_hopper(device, sorter, cards_by_id,
+                                              metrics)
+    device.print()
+    await device.save_state()
+    print(f'Total cards: {card_count}')
+    if metrics is not None:
+        metrics.end_pass()
+    if on_pass_complete is not None:
+        on_pass_complete(1, card_count)
+
+    hopper = sorter.get_results()
+    if common.get_setting(config, 'recognizer.candidates.restrict_to_hopper',
+                          True):
+        # After the first pass we know exactly which cards are in the hopper.
+        device.restrict_candidates(hopper)
+    sorter = sort_cards.make_subsequent_pass_sorter(
+        cards_by_id, hopper, tray_count,
+        common.get_setting(config, 'sort_strategy', 'pivots'))
+    sorter.print_pivots()
+    pass_number = 1
+    while not sorter.is_sorted():
+        await device.reload()
+        sorter.print_pivots()
+        pass_number += 1
+        if metrics is not None:
+            metrics.start_pass(pass_number, sorter.passes_remaining())
+        card_count = await sort_cards_from_hopper(device, sorter, cards_by_id,
+                                                  metrics)
+        device.print()
+        await device.save_state()
+        if metrics is not None:
+            metrics.end_pass()
+        sorter.reload_hopper()
+        if on_pass_complete is not None:
+            on_pass_complete(pass_number, card_count)
@@ -0,0 +1,223 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+# Simulates whole sorting sessions without the machine, the camera or the
+# recognizer, so changes to the sorting algorithm can be evaluated on any
+# number of stacks before touching the hardware. See simulate_sorts.py.
+
+import contextlib
+import io
+import json
+import random
+from collections import deque, namedtuple
+
+import sort_cards
+import sort_ranks
+
+# Seconds for each operation. Feeding, sending and reloading match the
+# emulator's default delays (see device_emulator.py).
+DEFAULT_COSTS = {
+    # Feeding a card from the hopper into the tray.
+    'feed': 0.6,
+    # Waiting for the card to settle, and recognizing it.
+    'recognize': 0.25,
+    # Sending the card in the tray into a basket.
+    'send': 0.5,
+    # The operator moving the baskets back into the hopper.
+    'reload': 20,
+}
+
+SimulationResult = namedtuple(
+    'SimulationResult', ' '.join([
+        'cards', 'passes', 'feeds', 'sends', 'reloads', 'seconds',
+        'misreads', 'out_of_sequence', 'out_of_order'
+    ]))
+
+
+class Machine:
+    """
+    The physical path of the cards: a hopper that cards are fed from, and the
+    output baskets they're sent into.
+
+    Each basket is a pile, with the first card sent to it at the bottom. The
+    hopper feeds from the bottom of its pile. When the hopper is reloaded, the
+    operator stacks the baskets into it one after the other, in
+    `reload_order`, each one as it is (so its bottom card is fed first), or
+    turned over if `flip_baskets` is set.
+
+    The sorters assume the README's instructions are followed: the baskets are
+    put back in tray order (left, then right), without turning them over. The
+    other options show what happens when they aren't, or when a machine with
+    more trays stacks them differently.
+    """
+    def __init__(self, stack, tray_count, reload_order=None,
+                 flip_baskets=False):
+        self.hopper = deque(stack)
+        self.baskets = [[] for _ in range(tray_count)]
+        self.reload_order = (reload_order if reload_order is not None else
+                             list(range(tray_count)))
+        self.flip_baskets = flip_baskets
+
+    def feed(self):
+        """Returns the next card in the hopper, or None if it's empty."""
+        return self.hopper.popleft() if self.hopper else None
+
+    def send(self, card_id, tray):
+        self.baskets[tray].append(card_id)
+
+    def reload(self):
+        for tray in self.reload_order:
+            basket = self.baskets[tray]
+            self.hopper.extend(reversed(basket) if self.flip_baskets else basket)
+        self.baskets = [[] for _ in self.baskets]
+
+    def final_stack(self):
+        """The cards in the order they'd be in after a final reload."""
+        self.reload()
+        return list(self.hopper)
+
+
+def simulate(cards_by_id,
+             stack,
+             tray_count=2,
+             costs=None,
+             reload_order=None,
+             flip_baskets=False,
+             strategy='pivots',
+             misread_rate=0,
+             seed=0):
+    """
+    Sorts the stack (a list of card ids, in the order they're fed from the
+    hopper) with FirstPassSorter and then the sorter `strategy` picks (see
+    sort_cards.make_subsequent_pass_sorter), exactly as sort_session.py does,
+    but with a simulated machine. Returns a SimulationResult.
+
+    Recognition is perfect, except that with probability `misread_rate`, a
+    card that has reprints with the same name and artwork (which the
+    recognizer often confuses, see pivot_expander.py) is recognized as one of
+    them, chosen at random with `seed`.
+
+    `out_of_sequence` counts the cards that didn't arrive in the order the
+    sorter predicted, which only happens if the machine doesn't stack the
+    baskets the way the sorter assumes, or a card was misread. `out_of_order`
+    counts the neighbouring cards in the final stack that are in the wrong
+    order. A few are expected with the 'pivots' strategy, because pivot
+    expansion lets reprints of a card land out of place.
+    """
+    costs = dict(DEFAULT_COSTS, **(costs or {}))
+    machine = Machine(stack, tray_count, reload_order, flip_baskets)
+    rng = random.Random(seed)
+    reprints = reprints_by_id(cards_by_id) if misread_rate else {}
+    feeds = 0
+    misreads = 0
+    out_of_sequence = 0
+
+    def recognize(card_id):
+        nonlocal misreads
+        if card_id in reprints and rng.random() < misread_rate:
+            misreads += 1
+            return rng.choice(reprints[card_id])
+        return card_id
+
+    def run_pass(sorter):
+        nonlocal feeds, out_of_sequence
+        card_id = machine.feed()
+        while card_id is not None:
+            feeds += 1
+            expected = sorter.predict_next()
+            if expected is not None and expected != card_id:
+                out_of_sequence += 1
+            machine.send(card_id, sorter.decide_direction(recognize(card_id)))
+            card_id = machine.feed()
+
+    # The sorters print every decision, which would swamp everything else.
+    with contextlib.redirect_stdout(io.StringIO()):
+        sorter = sort_cards.FirstPassSorter(cards_by_id, tray_count)
+        run_pass(sorter)
+        passes = 1
+        sorter = sort_cards.make_subsequent_pass_sorter(
+            cards_by_id, sorter.get_results(), tray_count, strategy)
+        while not sorter.is_sorted():
+            machine.reload()
+            run_pass(sorter)
+            sorter.reload_hopper()
+            passes += 1
+
+    ranks = sort_ranks.load_rank_table(cards_by_id)
+    final_ranks = [ranks.rank(card_id) for card_id in machine.final_stack()]
+    out_of_order = sum(
+        first > second for first, second in zip(final_ranks, final_ranks[1:]))
+    reloads = passes - 1
+    seconds = (feeds * (costs['feed'] + costs['recognize'] + costs['send']) +
+               reloads * costs['reload'])
+    return SimulationResult(len(stack), passes, feeds, feeds, reloads, seconds,
+                            misreads, out_of_sequence, out_of_order)
+
+
+def reprints_by_id(cards_by_id):
+    """
+    Returns, for every card with reprints that have the same name and artwork,
+    the ids of those reprints.
+    """
+    cards_by_key = {}
+    for card_id in cards_by_id.keys():
+        card = cards_by_id[card_id]
+        key = (card['name'], card['illustration_id'], card['full_art'])
+        cards_by_key.setdefault(key, []).append(card_id)
+    return {
+        card_id: [other for other in card_ids if other != card_id]
+        for card_ids in cards_by_key.values() if len(card_ids) > 1
+        for card_id in card_ids
+    }
+
+
+def presort(stack, cards_by_id, fraction, seed=0):
+    """
+    Returns a copy of the stack with `fraction` of the cards in sorted order,
+    and the rest shuffled in among them, as if someone had made a start on
+    sorting it.
+    """
+    ranks = sort_ranks.load_rank_table(cards_by_id)
+    rng = random.Random(seed)
+    stack = sorted(stack, key=ranks.rank)
+    shuffled = [i for i in range(len(stack)) if rng.random() >= fraction]
+    cards = [stack[i] for i in shuffled]
+    rng.shuffle(cards)
+    for i, card_id in zip(shuffled, cards):
+        stack[i] = card_id
+    return stack
+
+
+def read_recorded_stack(path):
+    """
+    Reads the order the cards were fed in from a file. It can be a text file
+    with a card id on each line (like emulator.deck), or the JSONL file that
+    metrics.py writes, in which case the first pass of the last session in it
+    is used.
+    """
+    with open(path, 'r', encoding='utf-8') as stack_file:
+        if not path.endswith('.jsonl'):
+            return [line.strip() for line in stack_file if line.strip()]
+        stack = []
+        for line in stack_file:
+            record = json.loads(line)
+            if record['event'] != 'card' or record['pass'] != 1:
+                continue
+            # The card numbers start again at 1 in each session.
+            if record['card'] == 1:
+                stack = []
+            stack.append(record['card_id'])
+        return stack
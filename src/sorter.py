@@ -14,61 +14,37 @@
 # You should have received a copy of the GNU General Public License along with
 # OpenSorts. If not, see <https://www.gnu.org/licenses/>.
 
-import json
-import pickle
-import sys
-import time
+import asyncio
 
-import arduino_device
-import sort_cards
-import prof_timer
+import async_device
 import common
-
-
-def sort_cards_from_hopper(device, sorter):
-    card_count = 0
-    while not device.is_hopper_empty():
-        card_id = device.identify_next()
-        card = cards_by_id[card_id]
-        card_name = card['name']
-        set_code = card['set']
-        direction = sorter.decide_direction(card_id)
-        card_count = card_count + 1
-        print(f'Recognized: {cards_by_id[card_id]["name"]} ' +
-              f'[{cards_by_id[card_id]["set"]}] -> {direction}')
-        if direction == 'left':
-            device.send_left()
-        else:
-            device.send_right()
-    return card_count
-
+import metrics
+import prof_timer
+import sort_session
 
 config = common.load_config()
+prof_timer.configure(config)
 
 print('Loading catalog')
 catalog, cards_by_id = common.load_catalog()
 
 input('Load the hopper and press \'Enter\' to continue.')
 
-print('Connecting to device')
-device = arduino_device.Sorter(config, catalog, cards_by_id)
-device.print()
+session_metrics = None
+if common.get_setting(config, 'metrics.enabled', False):
+    session_metrics = metrics.SessionMetrics(config)
 
-sorter = sort_cards.FirstPassSorter(cards_by_id)
-card_count = sort_cards_from_hopper(device, sorter)
+print('Connecting to device')
+device = async_device.AsyncSorter(config, catalog, cards_by_id,
+                                  session_metrics)
 device.print()
-print(f'Total cards: {card_count}')
 
-sorter = sort_cards.SubsequentPassSorter(cards_by_id, sorter.get_results())
-sorter.print_pivots()
-while not sorter.is_sorted():
-    device.reload()
-    sorter.print_pivots()
-    sort_cards_from_hopper(device, sorter)
-    device.print()
-    sorter.reload_hopper()
+asyncio.run(
+    sort_session.sort(device, cards_by_id, config, metrics=session_metrics))
 
 print('=============== FINAL DEVICE =================')
 device.print()
 print('Shutting down.')
-del device
+device.close()
+if session_metrics is not None:
+    session_metrics.close()
@@ -0,0 +1,76 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+# Compares the startup time and memory use of the runtime modules with the
+# lightweight tflite_runtime package and with full TensorFlow.
+
+import json
+import os
+import subprocess
+import sys
+
+import interpreters
+
+# Each configuration is measured in a fresh Python process so that nothing is
+# already imported. The child imports the runtime modules and creates the
+# corner detection interpreter, then reports how long that took and its peak
+# memory use.
+CHILD_SCRIPT = '''
+import json
+import time
+start = time.perf_counter()
+import arduino_device
+import card_recognizer
+import thumbnailer
+thumbnailer.Thumbnailer()
+elapsed = time.perf_counter() - start
+try:
+    import resource
+    # ru_maxrss is in kilobytes on Linux, and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+except ImportError:
+    peak_mb = None
+print(json.dumps({'seconds': elapsed, 'peak_mb': peak_mb}))
+'''
+
+RUNS = 3
+
+results = {}
+for backend in ['tflite_runtime', 'tensorflow']:
+    environment = dict(os.environ)
+    environment[interpreters.BACKEND_VARIABLE] = backend
+    runs = []
+    for _ in range(RUNS):
+        child = subprocess.run(
+            [sys.executable, '-c', 'import sys\n' + CHILD_SCRIPT],
+            env=environment,
+            capture_output=True,
+            text=True)
+        if child.returncode != 0:
+            print(f'{backend} failed to start:')
+            print(child.stderr)
+            break
+        runs.append(json.loads(child.stdout.strip().split('\n')[-1]))
+    if runs:
+        results[backend] = runs
+
+print(f'{"runtime":>16} {"startup s":>10} {"peak MB":>8}')
+for backend, runs in results.items():
+    seconds = min(run['seconds'] for run in runs)
+    peak_mb = runs[0]['peak_mb']
+    peak_text = f'{peak_mb:.0f}' if peak_mb is not None else 'n/a'
+    print(f'{backend:>16} {seconds:>10.2f} {peak_text:>8}')
@@ -0,0 +1,70 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+# Made up cards, for exercising the sorting algorithms at sizes that would be
+# impractical with a real collection.
+
+import random
+
+RARITIES = ['common', 'uncommon', 'rare', 'mythic', 'token', 'basic land']
+RARITY_WEIGHTS = [50, 25, 12, 3, 5, 5]
+COLOR_CATEGORIES = ['W', 'U', 'B', 'R', 'G', 'M', 'C', 'L']
+
+
+def make_cards(count, seed=0):
+    """
+    Returns a dictionary of `count` made up cards, by card id, with the fields
+    the sorter uses. Like real cards, many of them are reprints that share a
+    name and illustration with other cards, in different sets.
+    """
+    rng = random.Random(seed)
+    set_codes = [f's{i:03d}' for i in range(max(1, count // 250))]
+    artists = [f'Artist {i}' for i in range(max(1, count // 50))]
+    cards = {}
+    while len(cards) < count:
+        # A new card, and a few reprints of it.
+        name = f'Card {len(cards):06d}'
+        rarity = rng.choices(RARITIES, RARITY_WEIGHTS)[0]
+        color_category = rng.choice(COLOR_CATEGORIES)
+        illustration_id = f'illustration {len(cards):06d}'
+        artist = rng.choice(artists)
+        for _ in range(min(count - len(cards), 1 + int(rng.expovariate(1)))):
+            card_id = f'id{len(cards):06d}'
+            cards[f'{card_id}_0'] = {
+                'id': card_id,
+                'face_index': 0,
+                'name': name,
+                'set': rng.choice(set_codes),
+                'rarity': rarity,
+                'color_category': color_category,
+                'artist': artist,
+                'illustration_id': illustration_id,
+                'full_art': rng.random() < 0.05,
+                'released_at': f'20{rng.randint(0, 23):02d}-01-01',
+            }
+    return cards
+
+
+def make_stack(cards, count, seed=0):
+    """
+    Returns a shuffled stack of `count` card ids drawn from the cards, with
+    duplicates if there are fewer cards than that.
+    """
+    rng = random.Random(seed)
+    card_ids = list(cards.keys())
+    if count <= len(card_ids):
+        return rng.sample(card_ids, count)
+    return [rng.choice(card_ids) for _ in range(count)]
@@ -0,0 +1,109 @@
+# Copyright 2023 Kennet Belenky
+#
+# This file is part of OpenSorts.
+#
+# OpenSorts is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# OpenSorts is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# OpenSorts. If not, see <https://www.gnu.org/licenses/>.
+
+# Compares the thumbnailer backends on the full camera frames in the scans
+# directory (the ones camera_mode.py saves when you hit the space bar).
+#
+# For each backend, it reports how long it takes to get from a camera frame to
+# the embedding model's input, and how far the resulting embeddings are from
+# the ones the 'opencv' backend produces. The distances should be much smaller
+# than recognizer.verify_distance, and the recognized cards should agree.
+
+import os
+import time
+
+import cv2
+import numpy as np
+
+import card_recognizer
+import common
+import thumbnailer
+import transform
+
+SCANS_DIR = 'scans'
+RUNS = 20
+BACKENDS = ['opencv', 'direct', 'tfa']
+
+config = common.load_config()
+# Every card should go through the model.
+if common.get_setting(config, 'recognizer.cache') is not None:
+    config.recognizer.cache.enabled = False
+print('Loading catalog')
+catalog, cards_by_id = common.load_catalog()
+recognizer = card_recognizer.Recognizer(catalog, config)
+height, width = recognizer.image_dimensions
+
+frames = []
+for file in sorted(os.scandir(SCANS_DIR), key=lambda file: file.name):
+    frame = cv2.imread(file.path) if file.is_file() else None
+    if frame is not None and frame.shape[:2] == (720, 1280):
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+if not frames:
+    print(f'There are no 1280x720 camera frames in {SCANS_DIR}.')
+    raise SystemExit(1)
+print(f'Comparing on {len(frames)} frames')
+
+# The corner model is the same for every backend, so only run it once.
+corner_detector = thumbnailer.Thumbnailer(config)
+corners = [corner_detector.get_card_corners(frame) for frame in frames]
+
+
+def model_input(backend, frame, frame_corners):
+    """Takes the frame all the way to the embedding model's input."""
+    card_image, _ = backend.upright_card(frame, frame_corners)
+    if card_image.dtype != np.uint8:
+        card_image = (card_image * 255).astype(np.uint8)
+    card_image, _, _ = transform.automatic_brightness_and_contrast(card_image)
+    recognizer.preprocess(card_image)
+    return recognizer.model_input[0]
+
+
+def embed(image):
+    batch = np.repeat(image[np.newaxis], recognizer.batch_size, axis=0)
+    return recognizer.embed(batch)[0]
+
+
+results = {}
+for name in BACKENDS:
+    backend = thumbnailer.Thumbnailer(config)
+    backend.backend = name
+    backend.set_card_size(width, height)
+    try:
+        model_input(backend, frames[0], corners[0])
+    except ImportError:
+        print(f'Skipping {name}, which is not installed.')
+        continue
+    start = time.perf_counter()
+    for _ in range(RUNS):
+        for frame, frame_corners in zip(frames, corners):
+            model_input(backend, frame, frame_corners)
+    milliseconds = (time.perf_counter() - start) / (RUNS * len(frames)) * 1000
+    embeddings = []
+    card_ids = []
+    for frame, frame_corners in zip(frames, corners):
+        image = model_input(backend, frame, frame_corners)
+        embeddings.append(embed(image))
+        card_ids.append(recognizer.recognize(image * 0.5 + 0.5)[0])
+    results[name] = (milliseconds, np.array(embeddings), card_ids)
+
+reference = results['opencv']
+print(f'{"backend":>8} {"ms/frame":>9} {"mean distance":>14} ' +
+      f'{"max distance":>13} {"same card":>10}')
+for name, (milliseconds, embeddings, card_ids) in results.items():
+    distances = 1 - np.sum(embeddings * reference[1], axis=1)
+    same = sum(a == b for a, b in zip(card_ids, reference[2]))
+    print(f'{name:>8} {milliseconds:>9.2f} {np.mean(distances):>14.4f} ' +
+          f'{np.max(distances):>13.4f} {same:>6}/{len(card_ids):<3}')
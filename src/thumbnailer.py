@@ -16,8 +16,9 @@
 
 import cv2
 import numpy as np
-import tensorflow as tf
-import tensorflow_addons as tfa
+
+import common
+import interpreters
 import transform
 
 
@@ -45,9 +46,24 @@ def heatmap_to_corners(shape, heatmap):
 
 class Thumbnailer:
 
-    def __init__(self):
-        self.interpreter = tf.lite.Interpreter(model_path='corners.tflite')
-        self.interpreter.allocate_tensors()
+    def __init__(self, config=None):
+        # 'opencv' warps with cv2.warpPerspective. 'tfa' uses TensorFlow Addons,
+        # which means importing all of TensorFlow. Both crop the card to a
+        # sideways 640x448 image, which the recognizer rotates and shrinks.
+        # 'direct' warps with cv2.warpPerspective straight to an upright image
+        # of the size set with `set_card_size`, which saves the rotation and
+        # the full-size intermediate image.
+        self.backend = common.get_setting(config, 'thumbnailer.backend',
+                                          'opencv')
+        # How many times larger than the card size 'direct' warps before
+        # shrinking with area averaging.
+        self.supersample = common.get_setting(config,
+                                              'thumbnailer.supersample', 2)
+        # The (width, height) of upright card images, or None for full size.
+        self.card_size = None
+        self.warp_buffer = None
+        self.interpreter = interpreters.make_interpreter(
+            config, 'corners', 'corners.tflite')
         self.input_details = self.interpreter.get_input_details()[0]
         self.output_details = self.interpreter.get_output_details()[0]
 
@@ -70,15 +86,55 @@ class Thumbnailer:
         corners[3][1] = corners[3][1] * 720 / 192
         return corners
 
-    def thumbnail(self, input_image):
-        corners = self.get_card_corners(input_image)
+    def thumbnail(self, input_image, corners=None):
+        """
+        Returns the card cropped out of the image, and its corners. The corners
+        are found with the corner model, unless they're provided.
+        """
+        if corners is None:
+            corners = self.get_card_corners(input_image)
         # The corner keypoints are in a different order for the recognizer than
         # they are in keypoints_to_transform, so we have to reorder them.
         transform_vector = transform.keypoints_to_transform(
             640, 448, *corners[[0, 1, 3, 2]])
-        thumbnail = tfa.image.transform(input_image,
-                                        transform_vector,
-                                        interpolation='bilinear',
-                                        fill_value=255,
-                                        output_shape=(448, 640))
+        if self.backend == 'tfa':
+            import tensorflow_addons as tfa
+            thumbnail = tfa.image.transform(input_image,
+                                            transform_vector,
+                                            interpolation='bilinear',
+                                            fill_value=255,
+                                            output_shape=(448, 640)).numpy()
+        else:
+            thumbnail = transform.warp_perspective(input_image,
+                                                   transform_vector, 640, 448)
         return thumbnail, corners
+
+    def set_card_size(self, width, height):
+        """
+        Sets the size of the images `upright_card` returns with the 'direct'
+        backend. Normally that's the embedding model's input size.
+        """
+        self.card_size = (width, height)
+
+    def upright_card(self, input_image, corners=None, dst=None):
+        """
+        Returns the card cropped out of the image and rotated upright, and its
+        corners. With the 'direct' backend, the card image is `card_size`,
+        otherwise it's 448x640. The corners are found with the corner model,
+        unless they're provided. The card image is written into `dst` if it's
+        the right size.
+        """
+        if corners is None:
+            corners = self.get_card_corners(input_image)
+        if self.backend == 'direct' and self.card_size is not None:
+            card_image, self.warp_buffer = transform.warp_upright_card(
+                input_image,
+                corners,
+                *self.card_size,
+                supersample=self.supersample,
+                dst=dst,
+                buffer=self.warp_buffer)
+            return card_image, corners
+        thumbnail, corners = self.thumbnail(input_image, corners)
+        return cv2.rotate(thumbnail, cv2.ROTATE_90_COUNTERCLOCKWISE,
+                          dst=dst), corners
@@ -71,8 +71,84 @@ def keypoints_to_transform(width, height, top_left, top_right, bottom_left,
     return transform_vector
 
 
+def warp_perspective(image, transform_vector, width, height):
+    """
+    OpenCV equivalent of
+    tfa.image.transform(image, transform_vector, interpolation='bilinear',
+                        fill_value=255, output_shape=(height, width))
+    The transform vector maps output coordinates to input coordinates, which is
+    what cv2 calls the inverse map.
+    """
+    matrix = np.append(transform_vector, 1).reshape(3, 3)
+    return cv2.warpPerspective(image,
+                               matrix, (width, height),
+                               flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                               borderMode=cv2.BORDER_CONSTANT,
+                               borderValue=(255, 255, 255))
+
+
+def upright_card_matrix(corners, width, height):
+    """
+    Returns the 3x3 matrix that maps the card's corners in the camera image
+    (top left, top right, bottom right, bottom left, as the corner model finds
+    them) to an upright card image of the given size. The camera is mounted so
+    the card is sideways, so the rotation is folded into the matrix: the top
+    right corner in the camera image is the top left of the upright card.
+
+    The corners are on the outside edges of the card's pixels, but OpenCV puts
+    coordinates at pixel centers, so both sides are shifted by half a pixel.
+    Otherwise the card is off by a fraction of a pixel, which matters at the
+    model's resolution.
+    """
+    source = np.asarray(corners, dtype=np.single) - 0.5
+    destination = np.array([(0, height), (0, 0), (width, 0),
+                            (width, height)],
+                           dtype=np.single) - 0.5
+    return cv2.getPerspectiveTransform(source, destination)
+
+
+def warp_upright_card(image,
+                      corners,
+                      width,
+                      height,
+                      supersample=2,
+                      dst=None,
+                      buffer=None):
+    """
+    Crops the card out of the image straight into an upright image of the given
+    size, e.g. the embedding model's input size.
+
+    warpPerspective only samples bilinearly, which aliases when shrinking the
+    card by as much as this does. So the card is warped at `supersample` times
+    the size into `buffer`, then shrunk into `dst` with area averaging.
+    Returns (card image, buffer); pass the buffer back in to reuse it.
+    """
+    if supersample <= 1:
+        matrix = upright_card_matrix(corners, width, height)
+        return cv2.warpPerspective(image,
+                                   matrix, (width, height),
+                                   dst=dst,
+                                   flags=cv2.INTER_LINEAR,
+                                   borderMode=cv2.BORDER_CONSTANT,
+                                   borderValue=(255, 255, 255)), buffer
+    matrix = upright_card_matrix(corners, width * supersample,
+                                 height * supersample)
+    buffer = cv2.warpPerspective(image,
+                                 matrix,
+                                 (width * supersample, height * supersample),
+                                 dst=buffer,
+                                 flags=cv2.INTER_LINEAR,
+                                 borderMode=cv2.BORDER_CONSTANT,
+                                 borderValue=(255, 255, 255))
+    return cv2.resize(buffer, (width, height),
+                      dst=dst,
+                      interpolation=cv2.INTER_AREA), buffer
+
+
 # Lifted from: https://stackoverflow.com/questions/57030125
-def automatic_brightness_and_contrast(image, clip_hist_percent=1):
+# The histogram clipping has been vectorized, and the scaling is done with a
+# lookup table so that it can write into a preallocated `dst` buffer.
+def automatic_brightness_and_contrast(image, clip_hist_percent=1, dst=None):
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
     # Calculate grayscale histogram
@@ -80,37 +156,30 @@ def automatic_brightness_and_contrast(image, clip_hist_percent=1):
     hist_size = len(hist)
 
     # Calculate cumulative distribution from the histogram
-    accumulator = []
-    accumulator.append(float(hist[0]))
-    for index in range(1, hist_size):
-        accumulator.append(accumulator[index - 1] + float(hist[index]))
+    accumulator = np.cumsum(hist.ravel())
 
     # Locate points to clip
     maximum = accumulator[-1]
     clip_hist_percent *= (maximum / 100.0)
     clip_hist_percent /= 2.0
 
-    # Locate left cut
-    minimum_gray = 0
-    while accumulator[minimum_gray] < clip_hist_percent:
-        minimum_gray += 1
+    # Locate left cut: the first gray level whose cumulative count reaches the
+    # clip point.
+    minimum_gray = int(np.searchsorted(accumulator, clip_hist_percent))
 
-    # Locate right cut
-    maximum_gray = hist_size - 1
-    while accumulator[maximum_gray] >= (maximum - clip_hist_percent):
-        maximum_gray -= 1
+    # Locate right cut: the last gray level whose cumulative count is still
+    # below the upper clip point.
+    maximum_gray = int(
+        np.searchsorted(accumulator, maximum - clip_hist_percent)) - 1
+    maximum_gray = min(maximum_gray, hist_size - 1)
 
     # Calculate alpha and beta values
     alpha = 255 / (maximum_gray - minimum_gray)
     beta = -minimum_gray * alpha
-    '''
-    # Calculate new histogram with desired range and show histogram 
-    new_hist = cv2.calcHist([gray],[0],None,[256],[minimum_gray,maximum_gray])
-    plt.plot(hist)
-    plt.plot(new_hist)
-    plt.xlim([0,256])
-    plt.show()
-    '''
-
-    auto_result = cv2.convertScaleAbs(image, alpha=alpha, beta=beta)
+
+    # Equivalent to cv2.convertScaleAbs(image, alpha=alpha, beta=beta), but
+    # only computes the 256 possible values once.
+    lut = np.clip(np.rint(np.abs(np.arange(256) * alpha + beta)), 0,
+                  255).astype(np.uint8)
+    auto_result = cv2.LUT(image, lut, dst=dst)
     return (auto_result, alpha, beta)